@@ -18,5 +18,7 @@ __all__ = [
     'property_utils',
     'skinshortcuts',
     'template',
+    'template_utils',
+    'xml_utils',
     'xmlfunctions',
 ]
@@ -6,10 +6,13 @@
     See LICENSES/GPL-2.0-only.txt for more information.
 """
 
+import copy
 import os
 import re
 import unicodedata
 import xml.etree.ElementTree as ETree
+from collections import Counter
+from collections import OrderedDict
 from html.entities import name2codepoint
 from traceback import print_exc
 
@@ -30,6 +33,7 @@ from .constants import PROPERTIES_FILE
 from .constants import SKIN_DIR
 from .constants import SKIN_SHORTCUTS_PATH
 from .hash_utils import read_hashes
+from .property_utils import AdditionalProperties
 from .property_utils import read_properties
 
 # character entity reference
@@ -43,12 +47,151 @@ REPLACE1_REXP = re.compile(r'[\']+')
 REPLACE2_REXP = re.compile(r'[^-a-z0-9]+')
 REMOVE_REXP = re.compile(r'-{2,}')
 
+SLUGIFY_CACHE_SIZE = 2048
+
+# Actions whose shortcuts are only visible when a library node exists
+NODE_VISIBILITY_PREFIXES = (
+    # Video nodes
+    "activatewindow(videos,videodb://",
+    "activatewindow(videolibrary,videodb://",
+    "activatewindow(10025,videodb://",
+    "activatewindow(videos,library://video/",
+    "activatewindow(videolibrary,library://video",
+    "activatewindow(10025,library://video/",
+    # Audio nodes - Isengard and earlier
+    # (Note when cleaning up in the future, some of the Isengard checks -
+    # those with window 10502 - are still valid...)
+    "activatewindow(musiclibrary,musicdb://",
+    "activatewindow(10502,musicdb://",
+    "activatewindow(musiclibrary,library://music/",
+    "activatewindow(10502,library://music/",
+    # Audio nodes - Additional checks for Jarvis and later
+    "activatewindow(music,musicdb://",
+    "activatewindow(music,library://music/",
+)
+
+# Visibility conditions of particular actions
+VISIBILITY_ACTIONS = {
+    # Power menu visibilities
+    "quit()": "System.ShowExitButton",
+    "quit": "System.ShowExitButton",
+    "powerdown()": "System.CanPowerDown",
+    "powerdown": "System.CanPowerDown",
+    "alarmclock(shutdowntimer,shutdown())": "!System.HasAlarm(shutdowntimer) + "
+                                            "[System.CanPowerDown | System.CanSuspend "
+                                            "| System.CanHibernate]",
+    "cancelalarm(shutdowntimer)": "System.HasAlarm(shutdowntimer)",
+    "suspend()": "System.CanSuspend",
+    "suspend": "System.CanSuspend",
+    "hibernate()": "System.CanHibernate",
+    "hibernate": "System.CanHibernate",
+    "reset()": "System.CanReboot",
+    "reset": "System.CanReboot",
+    "system.logoff": "[System.HasLoginScreen | Integer.IsGreater(System.ProfileCount,1)] + "
+                     "System.Loggedon",
+    "mastermode": "System.HasLocks",
+    "inhibitidleshutdown(true)": "System.HasShutdown +!System.IsInhibit",
+    "inhibitidleshutdown(false)": "System.HasShutdown + System.IsInhibit",
+    "restartapp": "[System.Platform.Windows | System.Platform.Linux] +! "
+                  "System.Platform.Linux.RaspberryPi",
+    # General visibilities
+    "activatewindow(weather)": "!String.IsEmpty(Weather.Plugin)",
+    "xbmc.playdvd()": "System.HasMediaDVD",
+    "playdvd": "System.HasMediaDVD",
+}
+
+# Visibility conditions of actions starting with any of the prefixes, checked in order
+# [prefixes, visibility condition, only if PVR shortcuts are being hidden]
+VISIBILITY_PREFIXES = [
+    [("activatewindowandfocus(mypvr",), "PVR.HasTVChannels", False],
+    [("playpvr",), "PVR.HasTVChannels", True],
+    [("activatewindow(tv", "activatewindow(radio"), "System.HasPVRAddon", True],
+    [("activatewindow(videos,movie", "activatewindow(videos,recentlyaddedmovies"),
+     "Library.HasContent(Movies)", False],
+    [("activatewindow(videos,tvshow", "activatewindow(videos,recentlyaddedepisodes"),
+     "Library.HasContent(TVShows)", False],
+    [("activatewindow(videos,musicvideo", "activatewindow(videos,recentlyaddedmusicvideos"),
+     "Library.HasContent(MusicVideos)", False],
+    [("activatewindow(eventlog",), "system.getbool(eventlog.enabled)", False],
+]
+
+# Visibility conditions of actions, until the library nodes or PVR setting change
+VISIBILITY_CACHE = {
+    "signature": None,
+    "hide_pvr": True,
+    "actions": {}
+}
+
+# Localised strings, for the life of the process (or until the skin or language changes)
+LOCAL_CACHE = {
+    "context": None,
+    "strings": {}
+}
+
+
+class LabelIDList:
+    # The labelID's that have been given out. They're counted for fast lookups, kept in the order
+    # they were added so the last can be removed, and the next --[int] to try is kept for each
+    def __init__(self):
+        self.label_ids = Counter()
+        self.history = []
+        self.next_suffix = {}
+
+    def __contains__(self, label_id):
+        return self.label_ids[label_id] > 0
+
+    def append(self, label_id):
+        self.label_ids[label_id] += 1
+        self.history.append(label_id)
+
+    def pop(self):
+        label_id = self.history.pop()
+        self.label_ids[label_id] -= 1
+        if self.label_ids[label_id] == 0:
+            del self.label_ids[label_id]
+
+        # If this was a label_id--[int], the suffix may be free again, so it's the next one to try
+        base_label_id, _, suffix = label_id.rpartition("--")
+        if base_label_id and suffix.isdigit() and \
+                int(suffix) < self.next_suffix.get(base_label_id, 0):
+            self.next_suffix[base_label_id] = int(suffix)
+
+        return label_id
+
+    def add_unique(self, label_id):
+        # Add the label_id, or if it's already been given out the first free label_id--[int]
+        if label_id not in self:
+            self.append(label_id)
+            return label_id
+
+        suffix = self.next_suffix.get(label_id, 0)
+        while "%s--%s" % (label_id, suffix) in self:
+            suffix += 1
+
+        self.next_suffix[label_id] = suffix + 1
+        unique_label_id = "%s--%s" % (label_id, suffix)
+        self.append(unique_label_id)
+        return unique_label_id
+
 
 class DataFunctions:
     def __init__(self):
         self.node_func = nodefunctions.NodeFunctions()
 
+        self.check_local_cache()
+        self.checked_visibility_cache = False
+
         self.overrides = {}
+        self.override_index = {}
+
+        # Listings of the directories .DATA.xml files are loaded from, used instead of checking
+        # whether each file exists (None unless enabled for a build)
+        self.directory_snapshots = None
+
+        # Processed skin and script .DATA.xml files, and the labelID's they were given
+        # (None unless enabled for a build, as they depend on the properties and overrides
+        # loaded at the time)
+        self.processed_shortcuts = None
 
         self.widget_name_and_type = {}
         self.background_name = {}
@@ -59,6 +202,7 @@ class DataFunctions:
 
         self.current_properties = None
         self.default_properties = None
+        self.properties_index = {}
 
         self.property_information = {
             "fallbackProperties": {},
@@ -68,7 +212,12 @@ class DataFunctions:
             "templateOnly": None
         }
 
-        self.label_id_list = []
+        self.label_id_list = LabelIDList()
+
+        # Most recently used slugify results, and how often they were (or weren't) reused
+        self.slugify_cache = OrderedDict()
+        self.slugify_hits = 0
+        self.slugify_misses = 0
 
         self.default_overrides_file = os.path.join(DEFAULT_PATH, "overrides.xml")
         self.skin_overrides_file = os.path.join(SKIN_SHORTCUTS_PATH, "overrides.xml")
@@ -95,21 +244,8 @@ class DataFunctions:
         if get_default_id is True:
             return label_id
 
-        # Check if the label_id exists in the list
-        if label_id in self.label_id_list:
-            # We're going to add an --[int] to the end of this
-            count = 0
-            id_strtpl = "%s--%s"
-            while id_strtpl % (label_id, str(count)) in self.label_id_list:
-                count += 1
-
-            # We can now use this one
-            self.label_id_list.append(id_strtpl % (label_id, str(count)))
-            return id_strtpl % (label_id, str(count))
-
-        # We can use this one
-        self.label_id_list.append(label_id)
-        return label_id
+        # Store the label_id, adding an --[int] to the end of it if it's already been used
+        return self.label_id_list.add_unique(label_id)
 
     @staticmethod
     def _get_addon_label_id(action):
@@ -139,7 +275,7 @@ class DataFunctions:
 
     def clear_label_id(self):
         # This clears our stored list of label_id's
-        self.label_id_list = []
+        self.label_id_list = LabelIDList()
 
     def _pop_label_id(self):
         self.label_id_list.pop()
@@ -153,20 +289,11 @@ class DataFunctions:
         if profile_dir is None:
             profile_dir = PROFILE_PATH
 
-        user_shortcuts = self.data_xml_filename(os.path.join(profile_dir, "addon_data", ADDON_ID),
-                                                self.slugify(group, True,
-                                                             is_sub_level=is_sub_level))
-        skin_shortcuts = self.data_xml_filename(SKIN_SHORTCUTS_PATH, self.slugify(group))
-        default_shortcuts = self.data_xml_filename(DEFAULT_PATH, self.slugify(group))
-        if default_group is not None:
-            skin_shortcuts = self.data_xml_filename(SKIN_SHORTCUTS_PATH,
-                                                    self.slugify(default_group))
-            default_shortcuts = self.data_xml_filename(DEFAULT_PATH, self.slugify(default_group))
-
-        if defaults_only:
-            paths = [skin_shortcuts, default_shortcuts]
-        else:
-            paths = [user_shortcuts, skin_shortcuts, default_shortcuts]
+        paths = self.get_shortcuts_paths(group, default_group, profile_dir, defaults_only,
+                                         is_sub_level)
+        user_shortcuts = None
+        if not defaults_only:
+            user_shortcuts = paths[0]
 
         for path in paths:
             self.hashable.add(path)  # add paths to hashable items
@@ -175,7 +302,19 @@ class DataFunctions:
             log("Attempting to load file %s" % path)
             tree = None
 
-            if xbmcvfs.exists(path):
+            # During a build, skin and script shortcuts are processed the same way every time
+            # they're loaded
+            processed_key = None
+            if process_shortcuts and self.processed_shortcuts is not None and \
+                    path != user_shortcuts and self.data_xml_exists(path):
+                processed_key = self._get_processed_key(path, group, profile_dir)
+                if processed_key in self.processed_shortcuts:
+                    log("Loaded processed file %s" % path)
+                    root, label_id_list = self.processed_shortcuts[processed_key]
+                    self.label_id_list = copy.deepcopy(label_id_list)
+                    return ETree.ElementTree(copy.deepcopy(root))
+
+            if self.data_xml_exists(path):
                 try:
                     tree = ETree.parse(path)
                 except:
@@ -193,6 +332,10 @@ class DataFunctions:
                 else:
                     self._process_shortcuts(tree, group, profile_dir)
 
+                if processed_key is not None:
+                    self.processed_shortcuts[processed_key] = \
+                        (copy.deepcopy(tree.getroot()), copy.deepcopy(self.label_id_list))
+
                 log("Loaded file")
                 return tree
 
@@ -205,6 +348,51 @@ class DataFunctions:
         log("No shortcuts")
         return ETree.ElementTree(ETree.Element("shortcuts"))
 
+    def _get_processed_key(self, path, group, profile_dir):
+        # The file (and its size and modification time), the group it's being loaded for and
+        # the user overrides that will be applied to it
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        useroverrides = self._get_overrides_user(profile_dir)
+        return path, stat.st_size, stat.st_mtime_ns, group, id(useroverrides)
+
+    def data_xml_exists(self, path):
+        # Check whether a .DATA.xml file exists, using a snapshot of its directory if enabled
+        if self.directory_snapshots is None:
+            return xbmcvfs.exists(path)
+
+        directory, filename = os.path.split(path)
+        if directory not in self.directory_snapshots:
+            _, files = xbmcvfs.listdir(os.path.join(directory, ""))
+            self.directory_snapshots[directory] = set(os.path.normcase(file) for file in files)
+
+        return os.path.normcase(filename) in self.directory_snapshots[directory]
+
+    def get_shortcuts_paths(self, group, default_group=None, profile_dir=None,
+                            defaults_only=False, is_sub_level=False):
+        # This returns the .DATA.xml files get_shortcuts will try to load for a group,
+        # in the order in which they will be tried
+        if profile_dir is None:
+            profile_dir = PROFILE_PATH
+
+        user_shortcuts = self.data_xml_filename(os.path.join(profile_dir, "addon_data", ADDON_ID),
+                                                self.slugify(group, True,
+                                                             is_sub_level=is_sub_level))
+        skin_shortcuts = self.data_xml_filename(SKIN_SHORTCUTS_PATH, self.slugify(group))
+        default_shortcuts = self.data_xml_filename(DEFAULT_PATH, self.slugify(group))
+        if default_group is not None:
+            skin_shortcuts = self.data_xml_filename(SKIN_SHORTCUTS_PATH,
+                                                    self.slugify(default_group))
+            default_shortcuts = self.data_xml_filename(DEFAULT_PATH, self.slugify(default_group))
+
+        if defaults_only:
+            return [skin_shortcuts, default_shortcuts]
+
+        return [user_shortcuts, skin_shortcuts, default_shortcuts]
+
     def _process_shortcuts(self, tree, group, profile_dir="special://profile",
                            is_user_shortcuts=False):
         # This function will process any overrides and add them to the tree ready to be displayed
@@ -212,6 +400,9 @@ class DataFunctions:
         skinoverrides = self.get_overrides_skin()
         useroverrides = self._get_overrides_user(profile_dir)
 
+        skin_index = self._get_override_index("skin", skinoverrides)
+        user_index = self._get_override_index("user", useroverrides)
+
         self.clear_label_id()
 
         # Iterate through all <shortcut/> nodes
@@ -235,12 +426,10 @@ class DataFunctions:
             # group overrides: add an additional onclick action for a particular menu
             # this will allow you to close a modal dialog before calling any other window
             # http://forum.kodi.tv/showthread.php?tid=224683
-            all_group_overrides = skinoverrides.findall("groupoverride")
-            for override in all_group_overrides:
-                if override.attrib.get("group") == group:
-                    newaction = ETree.SubElement(node, "additional-action")
-                    newaction.text = override.text
-                    newaction.set("condition", override.attrib.get("condition"))
+            for override in skin_index["groupoverride"].get(group, []):
+                newaction = ETree.SubElement(node, "additional-action")
+                newaction.text = override.text
+                newaction.set("condition", override.attrib.get("condition"))
 
             # Generate the label_id
             label_id = self.get_label_id(
@@ -289,7 +478,7 @@ class DataFunctions:
                     additional_properties.remove(additional_property)
                     break
 
-            ETree.SubElement(node, "additional-properties").text = repr(additional_properties)
+            node.append(AdditionalProperties(additional_properties))
 
             icon_node = node.find("icon")
             if icon_node.text is None or icon_node.text == "":
@@ -314,11 +503,10 @@ class DataFunctions:
             if visibility_condition != "":
                 # Check whether visibility condition is overridden
                 overridden_visibility = False
-                for override in skinoverrides.findall("visibleoverride"):
-                    if override.attrib.get("condition").lower() != visibility_condition.lower():
-                        # Not overriding this visibility condition
-                        continue
-
+                visibility_overrides = skin_index["visibleoverride"].get(
+                    visibility_condition.lower(), []
+                )
+                for override in visibility_overrides:
                     if "group" in override.attrib and not override.attrib.get("group") == group:
                         # Not overriding this group
                         continue
@@ -342,23 +530,20 @@ class DataFunctions:
                     visibility_node = ETree.SubElement(node, "visibility")
                     visibility_node.text = visibility_condition
 
+            # Pull out the current action, and any already-overridden actions
+            items_to_override = node.findall("override-visibility")
+            if len(items_to_override) == 0:
+                items_to_override = [action]
+
             # Get action and visibility overrides
-            override_trees = [useroverrides, skinoverrides]
+            override_indexes = [user_index, skin_index]
             has_overriden = False
-            for override_tree in override_trees:
+            for override_index in override_indexes:
                 if has_overriden is True:
                     continue
 
-                if override_tree is not None:
-                    for elem in override_tree.findall("override"):
-                        # Pull out the current action, and any already-overridden actions
-                        items_to_override = []
-                        for item_to_override in node.findall("override-visibility"):
-                            items_to_override.append(item_to_override)
-
-                        if len(items_to_override) == 0:
-                            items_to_override = [action]
-
+                if override_index is not None:
+                    for elem in self._get_action_overrides(override_index, items_to_override):
                         # Retrieve group property
                         check_group = None
                         if "group" in elem.attrib:
@@ -426,8 +611,8 @@ class DataFunctions:
 
             node_strtpl = "[%s] + [%s]"
             # Get visibility condition of any skin-provided shortcuts
-            for elem in skinoverrides.findall("shortcut"):
-                if elem.text == action.text and "condition" in elem.attrib:
+            for elem in skin_index["shortcut"].get(action.text, []):
+                if "condition" in elem.attrib:
                     if not visibility_node:
                         ETree.SubElement(node, "visibility").text = elem.attrib.get("condition")
                     else:
@@ -445,6 +630,53 @@ class DataFunctions:
 
         return tree
 
+    def _get_override_index(self, name, tree):
+        # Index the overrides used by _process_shortcuts, so that each shortcut doesn't need to
+        # search through all of them
+        if name in self.override_index:
+            return self.override_index[name]
+
+        index = {
+            "groupoverride": {},  # by group
+            "visibleoverride": {},  # by lowercase condition
+            "override": {},  # by lowercase action, with their position in the file
+            "globaloverride": [],  # with their position in the file
+            "shortcut": {}  # by action
+        }
+
+        for position, elem in enumerate(tree.getroot()):
+            if elem.tag == "groupoverride":
+                index["groupoverride"].setdefault(elem.attrib.get("group"), []).append(elem)
+
+            elif elem.tag == "visibleoverride":
+                condition = elem.attrib.get("condition")
+                if condition is not None:
+                    index["visibleoverride"].setdefault(condition.lower(), []).append(elem)
+
+            elif elem.tag == "override":
+                override_action = elem.attrib.get("action")
+                if override_action == "globaloverride":
+                    index["globaloverride"].append((position, elem))
+                elif override_action is not None:
+                    index["override"].setdefault(override_action.lower(), []) \
+                        .append((position, elem))
+
+            elif elem.tag == "shortcut":
+                index["shortcut"].setdefault(elem.text, []).append(elem)
+
+        self.override_index[name] = index
+        return index
+
+    @staticmethod
+    def _get_action_overrides(index, items_to_override):
+        # Get the overrides that may apply to any of the actions, in the order they're in the file
+        overrides = dict(index["globaloverride"])
+        for item_to_override in items_to_override:
+            if item_to_override.text:
+                overrides.update(index["override"].get(item_to_override.text.lower(), []))
+
+        return [overrides[position] for position in sorted(overrides)]
+
     def _get_skin_required(self, listitems):
         # This function builds a tree of any skin-required shortcuts not currently in the menu
         # Once the tree is built, it sends them to _process_shortcuts for any overrides, etc,
@@ -786,9 +1018,33 @@ class DataFunctions:
                 self.default_properties.append(["mainmenu", label_id, "icon",
                                                 node.find("icon").text])
 
+        # Index both lists, so check_additional_properties doesn't need to search them
+        self.properties_index = {
+            "current": self._index_properties(self.current_properties),
+            "default": self._index_properties(self.default_properties)
+        }
+
         return_val = [self.current_properties, self.default_properties]
         return return_val
 
+    @staticmethod
+    def _index_properties(properties):
+        # Index properties by (group, labelID) and (group, defaultID), keeping their position
+        # in the list so they can be returned in their original order
+        by_label_id = {}
+        by_default_id = {}
+        for position, list_property in enumerate(properties):
+            if list_property is None:
+                continue
+
+            by_label_id.setdefault((list_property[0], list_property[1]), []) \
+                .append((position, list_property))
+            if len(list_property) != 4:
+                by_default_id.setdefault((list_property[0], list_property[4]), []) \
+                    .append((position, list_property))
+
+        return by_label_id, by_default_id
+
     def get_custom_property_fallbacks(self, group):
         if group in self.property_information["fallbacks"]:
             # We've already loaded everything, return it all
@@ -946,128 +1202,49 @@ class DataFunctions:
 
         return strings.get(item, default)
 
+    def check_visibility_cache(self):
+        # Clear the cached visibility conditions if the library nodes or PVR setting have changed
+        self.checked_visibility_cache = True
+
+        signature = self.node_func.get_library_signature()
+        hide_pvr = not ADDON.getSettingBool("donthidepvr")
+        if VISIBILITY_CACHE["signature"] != signature or VISIBILITY_CACHE["hide_pvr"] != hide_pvr:
+            VISIBILITY_CACHE["signature"] = signature
+            VISIBILITY_CACHE["hide_pvr"] = hide_pvr
+            VISIBILITY_CACHE["actions"] = {}
+
     def check_visibility(self, action):
         # Return whether mainmenu items should be displayed
+        if not self.checked_visibility_cache:
+            self.check_visibility_cache()
+
         action = action.lower().replace(" ", "").replace("\"", "")
 
+        if action not in VISIBILITY_CACHE["actions"]:
+            VISIBILITY_CACHE["actions"][action] = self._check_visibility(action)
+
+        return VISIBILITY_CACHE["actions"][action]
+
+    def _check_visibility(self, action):
         # Catch-all for shortcuts to plugins
         if "plugin://" in action:
             return ""
 
-        # Video node visibility
-        if action.startswith(("activatewindow(videos,videodb://",
-                              "activatewindow(videolibrary,videodb://",
-                              "activatewindow(10025,videodb://",
-                              "activatewindow(videos,library://video/",
-                              "activatewindow(videolibrary,library://video",
-                              "activatewindow(10025,library://video/")):
-            path = action.split(",")
-            if path[1].endswith(")"):
-                path[1] = path[1][:-1]
-
-            return self.node_func.get_visibility(path[1])
-
-        # Audio node visibility - Isengard and earlier
-        if action.startswith("activatewindow(musiclibrary,musicdb://") or \
-                action.startswith("activatewindow(10502,musicdb://") or \
-                action.startswith("activatewindow(musiclibrary,library://music/") or \
-                action.startswith("activatewindow(10502,library://music/"):
+        # Video and audio node visibility
+        if action.startswith(NODE_VISIBILITY_PREFIXES):
             path = action.split(",")
             if path[1].endswith(")"):
                 path[1] = path[1][:-1]
 
             return self.node_func.get_visibility(path[1])
 
-        # Audio node visibility - Additional checks for Jarvis and later
-        # (Note when cleaning up in the future, some of the Isengard checks -
-        # those with window 10502 - are still valid...)
-        if action.startswith("activatewindow(music,musicdb://") or \
-                action.startswith("activatewindow(music,library://music/"):
-            path = action.split(",")
-            if path[1].endswith(")"):
-                path[1] = path[1][:-1]
-
-            return self.node_func.get_visibility(path[1])
-
-        # Power menu visibilities
-        if action in ("quit()", "quit"):
-            return "System.ShowExitButton"
-
-        if action in ("powerdown()", "powerdown"):
-            return "System.CanPowerDown"
-
-        if action == "alarmclock(shutdowntimer,shutdown())":
-            return "!System.HasAlarm(shutdowntimer) + [System.CanPowerDown | System.CanSuspend " \
-                   "| System.CanHibernate]"
-
-        if action == "cancelalarm(shutdowntimer)":
-            return "System.HasAlarm(shutdowntimer)"
-
-        if action in ("suspend()", "suspend"):
-            return "System.CanSuspend"
-
-        if action in ("hibernate()", "hibernate"):
-            return "System.CanHibernate"
-
-        if action in ("reset()", "reset"):
-            return "System.CanReboot"
-
-        if action == "system.logoff":
-            return "[System.HasLoginScreen | Integer.IsGreater(System.ProfileCount,1)] + " \
-                   "System.Loggedon"
-
-        if action == "mastermode":
-            return "System.HasLocks"
-
-        if action == "inhibitidleshutdown(true)":
-            return "System.HasShutdown +!System.IsInhibit"
-
-        if action == "inhibitidleshutdown(false)":
-            return "System.HasShutdown + System.IsInhibit"
+        # Power menu and general visibilities
+        if action in VISIBILITY_ACTIONS:
+            return VISIBILITY_ACTIONS[action]
 
-        if action == "restartapp":
-            return "[System.Platform.Windows | System.Platform.Linux] +! " \
-                   "System.Platform.Linux.RaspberryPi"
-
-        # General visibilities
-        if action == "activatewindow(weather)":
-            return "!String.IsEmpty(Weather.Plugin)"
-
-        if action.startswith("activatewindowandfocus(mypvr") or action.startswith("playpvr") and \
-                not ADDON.getSettingBool("donthidepvr"):
-            return "PVR.HasTVChannels"
-
-        if action.startswith("activatewindow(tv") and not ADDON.getSettingBool("donthidepvr"):
-            return "System.HasPVRAddon"
-
-        if action.startswith("activatewindow(radio") and \
-                not ADDON.getSettingBool("donthidepvr"):
-            return "System.HasPVRAddon"
-
-        if action.startswith("activatewindow(videos,movie"):
-            return "Library.HasContent(Movies)"
-
-        if action.startswith("activatewindow(videos,recentlyaddedmovies"):
-            return "Library.HasContent(Movies)"
-
-        if action.startswith("activatewindow(videos,tvshow") or \
-                action.startswith("activatewindow(videos,tvshow"):
-            return "Library.HasContent(TVShows)"
-
-        if action.startswith("activatewindow(videos,recentlyaddedepisodes"):
-            return "Library.HasContent(TVShows)"
-
-        if action.startswith("activatewindow(videos,musicvideo"):
-            return "Library.HasContent(MusicVideos)"
-
-        if action.startswith("activatewindow(videos,recentlyaddedmusicvideos"):
-            return "Library.HasContent(MusicVideos)"
-
-        if action in ("xbmc.playdvd()", "playdvd"):
-            return "System.HasMediaDVD"
-
-        if action.startswith("activatewindow(eventlog"):
-            return "system.getbool(eventlog.enabled)"
+        for prefixes, visibility, is_pvr in VISIBILITY_PREFIXES:
+            if action.startswith(prefixes) and (VISIBILITY_CACHE["hide_pvr"] or not is_pvr):
+                return visibility
 
         return ""
 
@@ -1127,7 +1304,7 @@ class DataFunctions:
     def check_additional_properties(self, group, label_id, default_id, is_user_shortcuts):
         # Return any additional properties, including widgets, backgrounds, icons and thumbnails
         all_properties = self.get_additionalproperties()
-        current_properties = all_properties[1]
+        by_label_id, by_default_id = self.properties_index["default"]
 
         return_properties = []
 
@@ -1136,28 +1313,27 @@ class DataFunctions:
         #  all_properties[1] = Default properties
 
         if is_user_shortcuts and (len(all_properties[0]) == 0 or all_properties[0][0] is not None):
-            current_properties = all_properties[0]
+            by_label_id, by_default_id = self.properties_index["current"]
+
+        # Look up the current item by labelID, and by defaultID, keeping the properties in the
+        # order they were loaded (a property matching both is only included once)
+        matches = {}
+        if label_id is not None:
+            matches.update(by_label_id.get((group, label_id), []))
+
+        if default_id is not None:
+            matches.update(by_default_id.get((group, default_id), []))
 
-        # Loop through the current properties, looking for the current item
-        # pylint: disable=unsubscriptable-object
-        for current_property in current_properties:
+        for position in sorted(matches):
+            current_property = matches[position]
             # current_property[0] = Group name
             # current_property[1] = labelID
             # current_property[2] = Property name
             # current_property[3] = Property value
             # current_property[4] = defaultID
-            if label_id is not None and current_property[0] == group and \
-                    current_property[1] == label_id:
-                return_properties.append(
-                    self.upgrade_additional_properties(current_property[2], current_property[3])
-                )
-
-            elif len(current_property) != 4:
-                if default_id is not None and current_property[0] == group and \
-                        current_property[4] == default_id:
-                    return_properties.append(
-                        self.upgrade_additional_properties(current_property[2], current_property[3])
-                    )
+            return_properties.append(
+                self.upgrade_additional_properties(current_property[2], current_property[3])
+            )
 
         return return_properties
 
@@ -1306,8 +1482,33 @@ class DataFunctions:
             if level and (not elem.tail or not elem.tail.strip()):
                 elem.tail = whitespace
 
+    @staticmethod
+    def check_local_cache():
+        # Clear the cached localised strings if the skin or language has changed
+        context = (xbmc.getSkinDir(), xbmc.getLanguage())
+        if LOCAL_CACHE["context"] != context:
+            LOCAL_CACHE["context"] = context
+            LOCAL_CACHE["strings"] = {}
+
     @staticmethod
     def local(data):
+        if data is None:
+            return ["", "", "", ""]
+
+        key = (data, LOCAL_CACHE["context"])
+        cached = LOCAL_CACHE["strings"].get(key)
+        if cached is None:
+            cached = DataFunctions._local(data)
+            if not cached[3].isdigit():
+                # Nothing was localised, so there's nothing worth caching
+                return cached
+
+            LOCAL_CACHE["strings"][key] = cached
+
+        return list(cached)
+
+    @staticmethod
+    def _local(data):
         # This is our function to manage localisation
         # It accepts strings in one of the following formats:
         #   #####, ::LOCAL::#####, ::SCRIPT::#####
@@ -1402,6 +1603,35 @@ class DataFunctions:
     def slugify(self, text, user_shortcuts=False, entities=True, decimal=True,
                 hexadecimal=True, max_length=0, word_boundary=False, separator='-',
                 convert_int=False, is_sub_level=False):
+        # Whether menus are shared changes the result for user shortcuts, so it is part of the key
+        shared = None
+        if user_shortcuts is True:
+            shared = self.check_if_menus_shared(is_sub_level)
+
+        key = (text, user_shortcuts, entities, decimal, hexadecimal, max_length, word_boundary,
+               separator, convert_int, is_sub_level, shared)
+        if key in self.slugify_cache:
+            self.slugify_hits += 1
+            self.slugify_cache.move_to_end(key)
+            return self.slugify_cache[key]
+
+        self.slugify_misses += 1
+        text = self._slugify(text, entities=entities, decimal=decimal, hexadecimal=hexadecimal,
+                             max_length=max_length, word_boundary=word_boundary,
+                             separator=separator, convert_int=convert_int)
+
+        # If this is a shortcut file (.DATA.xml) and user shortcuts aren't shared, add the skin dir
+        if shared is False:
+            text = "%s-%s" % (SKIN_DIR, text)
+
+        self.slugify_cache[key] = text
+        if len(self.slugify_cache) > SLUGIFY_CACHE_SIZE:
+            self.slugify_cache.popitem(last=False)
+
+        return text
+
+    def _slugify(self, text, *, entities, decimal, hexadecimal, max_length, word_boundary,
+                 separator, convert_int):
         # Handle integers
         if convert_int and text.isdigit():
             text = "NUM-%s" % text
@@ -1448,10 +1678,6 @@ class DataFunctions:
         if separator != '-':
             text = text.replace('-', separator)
 
-        # If this is a shortcut file (.DATA.xml) and user shortcuts aren't shared, add the skin dir
-        if user_shortcuts is True and self.check_if_menus_shared(is_sub_level) is False:
-            text = "%s-%s" % (SKIN_DIR, text)
-
         return text
 
     # ----------------------------------------------------------------
@@ -33,7 +33,10 @@ from .constants import LANGUAGE
 from .constants import SKIN_DIR
 from .constants import SKIN_PATH
 from .constants import SKIN_SHORTCUTS_PATH
+from .property_utils import format_additional_properties
+from .property_utils import get_additional_properties
 from .property_utils import has_fallback_property
+from .property_utils import parse_additional_properties
 from .property_utils import read_properties
 from .property_utils import write_properties
 
@@ -412,11 +415,9 @@ class GUI(xbmcgui.WindowXMLDialog):
                 listitem.setProperty("LOCKED", locked.text)
 
         # Additional properties
-        additional_properties = item.find("additional-properties")
-        if additional_properties is not None:
-            listitem.setProperty("additionalListItemProperties", additional_properties.text)
-        else:
-            listitem.setProperty("additionalListItemProperties", "[]")
+        additional_properties = get_additional_properties(item.find("additional-properties"))
+        listitem.setProperty("additionalListItemProperties",
+                             format_additional_properties(additional_properties))
         self._add_additional_properties(listitem)
 
         return [is_visible, listitem]
@@ -443,7 +444,7 @@ class GUI(xbmcgui.WindowXMLDialog):
         # Process all custom properties
         custom_properties = listitem.getProperty("additionalListItemProperties")
         if custom_properties != "":
-            custom_properties = ast.literal_eval(custom_properties)
+            custom_properties = parse_additional_properties(custom_properties)
             for custom_property in custom_properties:
                 if custom_property[1].startswith("$") and \
                         not custom_property[1].startswith("$SKIN"):
@@ -687,7 +688,7 @@ class GUI(xbmcgui.WindowXMLDialog):
 
                     # Additional properties
                     if listitem.getProperty("additionalListItemProperties"):
-                        additional_properties = ast.literal_eval(
+                        additional_properties = parse_additional_properties(
                             listitem.getProperty("additionalListItemProperties")
                         )
                         if icon != "":
@@ -1470,7 +1471,6 @@ class GUI(xbmcgui.WindowXMLDialog):
 
                 # Save the labelID list from DATA
                 original_label_id_list = self.data_func.label_id_list
-                self.data_func.label_id_list = []
 
                 # Get a list of all shortcuts that were originally in the menu and
                 # restore label_id_list
@@ -2509,7 +2509,9 @@ class GUI(xbmcgui.WindowXMLDialog):
         # Add an item to the additional properties of a user items
         properties = []
         if listitem.getProperty("additionalListItemProperties"):
-            properties = ast.literal_eval(listitem.getProperty("additionalListItemProperties"))
+            properties = parse_additional_properties(
+                listitem.getProperty("additionalListItemProperties")
+            )
 
         found_property = False
         for idx, prop in enumerate(properties):
@@ -2529,7 +2531,8 @@ class GUI(xbmcgui.WindowXMLDialog):
                 if property_value.isdigit():
                     listitem.setProperty("%s-NUM" % property_name, property_value)
 
-        listitem.setProperty("additionalListItemProperties", repr(properties))
+        listitem.setProperty("additionalListItemProperties",
+                             format_additional_properties(properties))
 
         self._add_additional_properties(listitem)
 
@@ -2537,14 +2540,17 @@ class GUI(xbmcgui.WindowXMLDialog):
         # Remove an item from the additional properties of a user item
         properties = []
         if listitem.getProperty("additionalListItemProperties"):
-            properties = ast.literal_eval(listitem.getProperty("additionalListItemProperties"))
+            properties = parse_additional_properties(
+                listitem.getProperty("additionalListItemProperties")
+            )
 
         for prop in properties:
             if prop[0] == property_name or "%s-NUM" % (prop[0]) == "%s-NUM" % property_name:
                 listitem.setProperty(prop[0], None)
                 properties.remove(prop)
 
-        listitem.setProperty("additionalListItemProperties", repr(properties))
+        listitem.setProperty("additionalListItemProperties",
+                             format_additional_properties(properties))
 
         self._add_additional_properties(listitem)
 
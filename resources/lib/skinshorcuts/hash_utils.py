@@ -10,16 +10,23 @@ import ast
 import hashlib
 import json
 import os
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 import xbmcvfs
 
 from .common import log
 from .common import read_file
 from .common import write_file
+from .constants import ADDON
 from .constants import HASH_FILE
 
 
+def generate_hash(contents):
+    return hashlib.md5(contents).hexdigest()
+
+
 def generate_file_hash(filename):
     if not os.path.isfile(filename):
         return None
@@ -43,6 +50,50 @@ def generate_file_hash(filename):
         raise
 
 
+def generate_file_hashes(filenames, workers=None):
+    # Hash files on a thread pool, as reading them is I/O bound. Hashes are returned in the same
+    # order as filenames, with None for any file which doesn't exist or couldn't be read
+    filenames = list(filenames)
+    if workers is None:
+        workers = hash_workers()
+
+    if workers <= 1 or len(filenames) <= 1:
+        return [_generate_file_hash(filename) for filename in filenames]
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(filenames))) as executor:
+        return list(executor.map(_generate_file_hash, filenames))
+
+
+def _generate_file_hash(filename):
+    try:
+        return generate_file_hash(filename)
+    except:
+        return None
+
+
+def hash_workers():
+    try:
+        return max(1, ADDON.getSettingInt("hash_workers"))
+    except:
+        return 1
+
+
+def generate_file_stat(filename):
+    # The size, modification time and inode of a file, stored alongside its hash so unchanged
+    # files don't need to be hashed again
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+
+    # A file modified in the last couple of seconds could be modified again without its
+    # size or modification time changing, so it will always need hashing
+    if time.time_ns() - stat.st_mtime_ns < 2000000000:
+        return None
+
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+
 def read_hashes(hash_file=None):
     if not hash_file:
         hash_file = HASH_FILE
@@ -25,17 +25,108 @@ from .constants import LANGUAGE
 from .constants import PROFILE_PATH
 from .property_utils import write_properties
 
+# The custom and default library nodes, for the life of the process (or until a node
+# is added, removed or modified)
+LIBRARY_NODES = {
+    "signature": None,
+    "directories": {},  # directory: [directories, files]
+    "nodes": {}  # filename: details of the node, or None if it couldn't be parsed
+}
+
 
 class NodeFunctions:
     def __init__(self):
         self.index_counter = 0
+        self.checked_library_nodes = False
+
+    ##########################################
+    # Index of the library nodes' .xml files #
+    ##########################################
+
+    def get_library_nodes(self):
+        # Get the library nodes, parsing them again if a node has been added, removed or modified
+        if self.checked_library_nodes:
+            return LIBRARY_NODES
+
+        self.checked_library_nodes = True
+
+        signature = []
+        directories = {}
+        for library in (os.path.join(PROFILE_PATH, "library"),
+                        os.path.join(KODI_PATH, "system", "library")):
+            for node_type in ("video", "music"):
+                self._scan_library_directory(os.path.join(library, node_type), signature,
+                                             directories)
+
+        if LIBRARY_NODES["signature"] != signature:
+            nodes = {}
+            for dirpath, (_, filenames) in directories.items():
+                for filename in filenames:
+                    if filename.endswith(".xml"):
+                        node_file = os.path.join(dirpath, filename)
+                        nodes[self._node_key(node_file)] = self._parse_library_node(node_file)
+
+            LIBRARY_NODES["signature"] = signature
+            LIBRARY_NODES["directories"] = directories
+            LIBRARY_NODES["nodes"] = nodes
+
+        return LIBRARY_NODES
+
+    def _scan_library_directory(self, path, signature, directories):
+        # Add the listing of a node directory and its subdirectories, and the modification time
+        # and size of each of their files, using xbmcvfs in the same way get_nodes always has
+        if not xbmcvfs.exists(os.path.join(path, "")):
+            return
+
+        dirs, files = xbmcvfs.listdir(os.path.join(path, ""))
+        directories[self._node_key(path)] = [dirs, files]
+
+        signature.append((path, None, None))
+        for file in files:
+            stat = xbmcvfs.Stat(os.path.join(path, file))
+            signature.append((os.path.join(path, file), stat.st_mtime(), stat.st_size()))
+
+        for _dir in dirs:
+            self._scan_library_directory(os.path.join(path, _dir), signature, directories)
+
+    def node_exists(self, filename):
+        return self._node_key(filename) in self.get_library_nodes()["nodes"]
+
+    def get_node(self, filename):
+        return self.get_library_nodes()["nodes"].get(self._node_key(filename))
+
+    @staticmethod
+    def _node_key(path):
+        return os.path.normcase(os.path.normpath(path))
+
+    @staticmethod
+    def _parse_library_node(filename):
+        # Get the details we use from a node's .xml file. Elements are only included if they're
+        # in the file, so we can tell a missing element from an empty one
+        try:
+            root = ETree.parse(filename).getroot()
+        except:
+            log(print_exc())
+            return None
+
+        node = {
+            "visible": root.attrib.get("visible"),
+            "order": root.attrib.get("order"),
+            "group": root.find("group") is not None
+        }
+        for tag in ("label", "icon", "content", "path"):
+            elem = root.find(tag)
+            if elem is not None:
+                node[tag] = elem.text
+
+        return node
 
     ##############################################
     # Functions used by library.py to list nodes #
     ##############################################
 
     def get_nodes(self, path, prefix):
-        dirs, files = xbmcvfs.listdir(path)
+        dirs, files = self.get_library_nodes()["directories"].get(self._node_key(path), [[], []])
         nodes = {}
 
         try:
@@ -53,7 +144,7 @@ class NodeFunctions:
 
     def parse_node(self, node, directory, nodes, prefix):
         # If the folder we've been passed contains an index.xml, send that file to be processed
-        if xbmcvfs.exists(os.path.join(node, "index.xml")):
+        if self.node_exists(os.path.join(node, "index.xml")):
             self.parse_view(os.path.join(node, "index.xml"), nodes, True,
                             "%s/%s/" % (prefix, directory), node)
 
@@ -61,16 +152,14 @@ class NodeFunctions:
         if not is_folder and file.endswith("index.xml"):
             return
 
-        try:
-            # Load the xml file
-            with open(file.encode('utf-8'), "rb") as infile:
-                filedata = infile.read().decode('utf-8')
-
-            root = ETree.fromstring(filedata)
+        node = self.get_node(file)
+        if node is None:
+            return
 
+        try:
             # Get the item index
-            if "order" in root.attrib:
-                index = root.attrib.get("order")
+            if node["order"] is not None:
+                index = node["order"]
                 orig_index = index
                 while int(index) in nodes:
                     index = int(index)
@@ -84,8 +173,8 @@ class NodeFunctions:
 
             # Try to get media type from visibility condition
             media_type = None
-            if "visible" in root.attrib:
-                visible_attrib = root.attrib.get("visible")
+            if node["visible"] is not None:
+                visible_attrib = node["visible"]
                 if not xbmc.getCondVisibility(visible_attrib):
                     # The node isn't visible
                     return
@@ -95,18 +184,12 @@ class NodeFunctions:
                     media_type = visible_attrib.split("(")[1].split(")")[0].lower()
 
             # Try to get media type from content node
-            content_node = root.find("content")
-            if content_node is not None:
-                media_type = content_node.text
+            if "content" in node:
+                media_type = node["content"]
 
             # Get label and icon
-            label = root.find("label").text
-
-            icon = root.find("icon")
-            if icon is not None:
-                icon = icon.text
-            else:
-                icon = ""
+            label = node["label"]
+            icon = node.get("icon", "")
 
             if is_folder:
                 # Add it to our list of nodes
@@ -114,14 +197,12 @@ class NodeFunctions:
 
             else:
                 # Check for a path
-                path = root.find("path")
-                if path is not None:
+                if "path" in node:
                     # Change the orig_path (the url used as the shortcut address) to it
-                    orig_path = path.text
+                    orig_path = node["path"]
 
                 # Check for a grouping
-                group = root.find("group")
-                if group is None:
+                if not node["group"]:
                     # Add it as an item
                     nodes[int(index)] = [label, icon, orig_path, "item", orig_index, media_type]
 
@@ -131,8 +212,7 @@ class NodeFunctions:
         except:
             log(print_exc())
 
-    @staticmethod
-    def is_grouped(path):
+    def is_grouped(self, path):
         custom_path_video = path.replace(
             "library://video",
             os.path.join(PROFILE_PATH, "library", "video")
@@ -157,7 +237,7 @@ class NodeFunctions:
         found_path = False
 
         for try_path in paths:
-            if xbmcvfs.exists(try_path):
+            if self.node_exists(try_path):
                 path = try_path
                 found_path = True
                 break
@@ -165,22 +245,18 @@ class NodeFunctions:
         if found_path is False:
             return False
 
-        # Open the file
-        try:
-            # Load the xml file
-            tree = ETree.parse(path)
-            root = tree.getroot()
-
-            group = root.find("group")
-            return group is not None
-
-        except:
-            return False
+        node = self.get_node(path)
+        return node is not None and node["group"]
 
     #####################################
     # Function used by DataFunctions.py #
     #####################################
 
+    def get_library_signature(self):
+        # The modification times of the library nodes, which change when a node is
+        # added, removed or edited
+        return self.get_library_nodes()["signature"]
+
     def get_visibility(self, path):
         path, path_start, path_end = self._modify_path_and_parts(path)
 
@@ -201,14 +277,14 @@ class NodeFunctions:
         # Check whether the node exists - either as a parent node (with an index.xml)
         # or a view node (append .xml) in first custom video nodes, then default video nodes
         node_file = None
-        if xbmcvfs.exists(custom_path):
+        if self.node_exists(custom_path):
             node_file = custom_path
-        elif xbmcvfs.exists(default_path):
+        elif self.node_exists(default_path):
             node_file = default_path
 
-        if xbmcvfs.exists(custom_file):
+        if self.node_exists(custom_file):
             node_file = custom_file
-        elif xbmcvfs.exists(default_file):
+        elif self.node_exists(default_file):
             node_file = default_file
 
         # Next check if there is a parent node
@@ -224,9 +300,9 @@ class NodeFunctions:
                                           os.path.join(KODI_PATH, "system", "library", path_end))
         node_parent = None
 
-        if xbmcvfs.exists(custom_path):
+        if self.node_exists(custom_path):
             node_parent = custom_path
-        elif xbmcvfs.exists(default_path):
+        elif self.node_exists(default_path):
             node_parent = default_path
 
         if not node_file and not node_parent:
@@ -236,17 +312,9 @@ class NodeFunctions:
             if xml_file is None:
                 continue
 
-            # Open the file
-            try:
-                # Load the xml file
-                tree = ETree.parse(xml_file)
-                root = tree.getroot()
-
-                if "visible" in root.attrib:
-                    return root.attrib.get("visible")
-
-            except:
-                pass
+            node = self.get_node(xml_file)
+            if node is not None and node["visible"] is not None:
+                return node["visible"]
 
         return ""
 
@@ -269,42 +337,36 @@ class NodeFunctions:
 
         # Check whether the node exists - either as a parent node (with an index.xml)
         # or a view node (append .xml) in first custom video nodes, then default video nodes
-        if xbmcvfs.exists(custom_path):
+        if self.node_exists(custom_path):
             path = custom_path
 
-        elif xbmcvfs.exists(custom_file):
+        elif self.node_exists(custom_file):
             path = custom_file
 
-        elif xbmcvfs.exists(default_path):
+        elif self.node_exists(default_path):
             path = default_path
 
-        elif xbmcvfs.exists(default_file):
+        elif self.node_exists(default_file):
             path = default_file
 
         else:
             return "unknown"
 
-        # Open the file
-        try:
-            # Load the xml file
-            tree = ETree.parse(path)
-            root = tree.getroot()
-
-            media_type = "unknown"
-            if "visible" in root.attrib:
-                visible_attrib = root.attrib.get("visible")
-                if "Library.HasContent(" in visible_attrib and "+" not in visible_attrib and \
-                        "|" not in visible_attrib:
-                    media_type = visible_attrib.split("(")[1].split(")")[0].lower()
+        node = self.get_node(path)
+        if node is None:
+            return "unknown"
 
-            content_node = root.find("content")
-            if content_node is not None:
-                media_type = content_node.text
+        media_type = "unknown"
+        if node["visible"] is not None:
+            visible_attrib = node["visible"]
+            if "Library.HasContent(" in visible_attrib and "+" not in visible_attrib and \
+                    "|" not in visible_attrib:
+                media_type = visible_attrib.split("(")[1].split(")")[0].lower()
 
-            return media_type
+        if "content" in node:
+            media_type = node["content"]
 
-        except:
-            return "unknown"
+        return media_type
 
     ##################################################
     # Functions to externally add a node to the menu #
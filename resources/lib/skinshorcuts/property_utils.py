@@ -7,8 +7,10 @@
 """
 
 import ast
+import hashlib
 import json
 import traceback
+import xml.etree.ElementTree as ETree
 
 import xbmcvfs
 
@@ -17,6 +19,63 @@ from .common import read_file
 from .common import write_file
 from .constants import PROPERTIES_FILE
 
+# Parsed additional properties, keyed by their text
+ADDITIONAL_PROPERTIES_CACHE = {}
+ADDITIONAL_PROPERTIES_CACHE_SIZE = 1024
+
+
+class AdditionalProperties(ETree.Element):
+    # The <additional-properties /> of a processed shortcut, which keeps the properties as a list
+    # of [name, value] so they don't need to be written out as text and parsed back again
+    def __init__(self, properties):
+        super().__init__("additional-properties")
+        self.properties = properties
+
+    def __copy__(self):
+        return AdditionalProperties(self.properties)
+
+    def __deepcopy__(self, memo):
+        return AdditionalProperties([list(prop) for prop in self.properties])
+
+
+def get_additional_properties(element):
+    # Get the additional properties of a shortcut from its <additional-properties /> element
+    if element is None:
+        return []
+
+    if isinstance(element, AdditionalProperties):
+        return element.properties
+
+    if not element.text:
+        return []
+
+    return parse_additional_properties(element.text)
+
+
+def format_additional_properties(properties):
+    # Format additional properties as text, for storing on a listitem
+    text = repr(properties)
+    _cache_additional_properties(text, properties)
+    return text
+
+
+def parse_additional_properties(text):
+    # Parse additional properties stored on a listitem, only parsing each text once
+    cached = ADDITIONAL_PROPERTIES_CACHE.get(text)
+    if cached is None:
+        cached = _cache_additional_properties(text, ast.literal_eval(text))
+
+    return [list(prop) for prop in cached]
+
+
+def _cache_additional_properties(text, properties):
+    if len(ADDITIONAL_PROPERTIES_CACHE) >= ADDITIONAL_PROPERTIES_CACHE_SIZE:
+        ADDITIONAL_PROPERTIES_CACHE.clear()
+
+    cached = tuple(tuple(prop) for prop in properties)
+    ADDITIONAL_PROPERTIES_CACHE[text] = cached
+    return cached
+
 
 def read_properties():
     payload = []
@@ -44,6 +103,20 @@ def write_properties(data):
         log('Failed to write properties to %s' % PROPERTIES_FILE)
 
 
+def hash_properties():
+    # Hash the saved properties of each group separately, so we can tell which
+    # groups an edit to the properties file has touched
+    grouped_properties = {}
+    for saved_property in read_properties():
+        grouped_properties.setdefault(saved_property[0], []).append(saved_property)
+
+    payload = {}
+    for group, saved_properties in grouped_properties.items():
+        payload[group] = hashlib.md5(json.dumps(saved_properties).encode('utf-8')).hexdigest()
+
+    return payload
+
+
 def has_fallback_property(fallback_property, match_properties):
     if not len(fallback_property) >= 3:
         return False
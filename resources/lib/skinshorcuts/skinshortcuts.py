@@ -21,11 +21,7 @@ import xbmcgui
 import xbmcplugin
 import xbmcvfs
 
-from . import datafunctions
 from . import jsonrpc
-from . import library
-from . import nodefunctions
-from . import xmlfunctions
 from .common import log
 from .constants import ADDON_NAME
 from .constants import CWD
@@ -40,10 +36,12 @@ class Script:
     def __init__(self):
         self._parse_argv()
 
-        self.data_func = datafunctions.DataFunctions()
-        self.node_func = nodefunctions.NodeFunctions()
-        self.xml_func = xmlfunctions.XMLFunctions()
-        self.lib_func = library.LibraryFunctions()
+        # Only the modules a route uses are imported, when it first uses them (see the properties
+        # below), as launching a shortcut shouldn't have to load the menu building code
+        self._data_func = None
+        self._node_func = None
+        self._xml_func = None
+        self._lib_func = None
 
         # Create data and master paths if not exists
         if not xbmcvfs.exists(DATA_PATH):
@@ -51,6 +49,38 @@ class Script:
         if not xbmcvfs.exists(MASTER_PATH):
             xbmcvfs.mkdir(MASTER_PATH)
 
+    @property
+    def data_func(self):
+        # pylint: disable=import-outside-toplevel
+        if self._data_func is None:
+            from . import datafunctions
+            self._data_func = datafunctions.DataFunctions()
+        return self._data_func
+
+    @property
+    def node_func(self):
+        # pylint: disable=import-outside-toplevel
+        if self._node_func is None:
+            from . import nodefunctions
+            self._node_func = nodefunctions.NodeFunctions()
+        return self._node_func
+
+    @property
+    def xml_func(self):
+        # pylint: disable=import-outside-toplevel
+        if self._xml_func is None:
+            from . import xmlfunctions
+            self._xml_func = xmlfunctions.XMLFunctions()
+        return self._xml_func
+
+    @property
+    def lib_func(self):
+        # pylint: disable=import-outside-toplevel
+        if self._lib_func is None:
+            from . import library
+            self._lib_func = library.LibraryFunctions()
+        return self._lib_func
+
     def route(self):
         """
         Entry point for script
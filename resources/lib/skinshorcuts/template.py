@@ -9,15 +9,22 @@
 import ast
 import operator
 import os
+import re
 import xml.etree.ElementTree as ETree
+from collections import deque
 
 import xbmc
 import xbmcvfs
 from simpleeval import SimpleEval
-from simpleeval import simple_eval
 
 from .common import log
 from .constants import SKIN_SHORTCUTS_PATH
+from .template_utils import TemplateNode
+from .template_utils import get_fingerprint
+from .template_utils import is_static
+
+# Tags which findall() would match against an element's children, rather than treating as a path
+SIMPLE_TAG = re.compile(r'[\w-]+')
 
 
 class Template:
@@ -26,6 +33,12 @@ class Template:
         self.templatepath = os.path.join(SKIN_SHORTCUTS_PATH, "template.xml")
         self.other_templates = []
 
+        # Submenu templates by (level, name), and the properties of property groups by their
+        # lowercase name (see index_template)
+        self.named_submenus = {}
+        self.submenus = {}
+        self.property_groups = {}
+
         try:
             self.tree = ETree.parse(self.templatepath)
 
@@ -43,6 +56,8 @@ class Template:
                 if include_name not in self.other_templates:
                     self.other_templates.append(include_name)
 
+            self.index_template()
+
         except:
             # We couldn't load the template.xml file
             if xbmcvfs.exists(self.templatepath):
@@ -55,14 +70,22 @@ class Template:
         # Empty variable which will contain our base elementree (passed from buildxml)
         self.includes = None
 
+        # The includes in it, by name, and the (name, condition) of the includes within them
+        self.include_tree = None
+        self.include_names = {}
+        self.include_conditions = set()
+
         # Empty progress which will contain the Kodi progress dialog gui (passed from buildxml)
         self.progress = None
         self.percent = None
         self.current = None
 
-        # List which will contain 'other' elements we will need to finalize (we won't have all the
-        # visibility conditions until the end)
-        self.finalize = []
+        # 'other' elements we will need to finalize (we won't have all the visibility conditions
+        # until the end), by their include and fingerprint
+        self.finalize = {}
+
+        # Compiled parts of the template, by the element they were compiled from
+        self.programs = {}
 
         # Initialize simple eval
         self.simple_eval = SimpleEval()
@@ -81,8 +104,6 @@ class Template:
         # Get the template for this menu
         if menu_type == "mainmenu":
             template = self.tree.find("mainmenu")
-            if template is not None:
-                template = self.copy_tree(template)
 
         else:
             if len(items.findall("item")) == 0:
@@ -112,14 +133,14 @@ class Template:
             if mainmenuitems is not None:
                 properties = self.get_properties(template, mainmenuitems)
 
-            # Now replace all <skinshortcuts> elements with correct data
-            self.replace_elements(template.find("controls"), visibility_condition,
-                                  profile_visibility, items, properties,
-                                  customitems=template.findall("items"))
-
-            # Add the template to the includes
-            for child in template.find("controls"):
-                include_tree.append(child)
+            # Now replace all <skinshortcuts> elements with correct data, and add the template
+            # to the includes
+            include_tree.extend(
+                self.replace_elements(self.get_program(template.find("controls")),
+                                      visibility_condition, profile_visibility, items,
+                                      properties=properties,
+                                      customitems=template.findall("items"))
+            )
 
         # Now we want to see if any of the main menu items match a template
         if not build_others or len(self.other_templates) == 0:
@@ -199,7 +220,7 @@ class Template:
         final_variables = {}
         final_variable_names = []
 
-        for template in self.finalize:
+        for template in self.finalize.values():
             # Get the group name
             name = "skinshortcuts-template"
             if "include" in template.attrib:
@@ -212,6 +233,7 @@ class Template:
                     self.other_templates.remove(name)
 
             # Loop through any profiles we have
+            program = TemplateNode(template)
             for profile in template.findall("skinshortcuts-profile"):
                 visibility_condition = None
                 # Build the visibility condition
@@ -230,9 +252,9 @@ class Template:
                                            None, None)  # profile.attrib.get( "visible" ) )
 
                 # Create a copy of the node with any changes within (this time it'll be visibility)
-                final = self.copy_tree(template)
-                self.replace_elements(final, visibility_condition,
-                                      profile.attrib.get("visible"), [])
+                final = ETree.Element(template.tag, template.attrib)
+                final.extend(self.replace_elements(program, visibility_condition,
+                                                   profile.attrib.get("visible"), []))
 
                 # Add the template to the includes
                 controls = final.find("controls")
@@ -342,74 +364,70 @@ class Template:
 
         return return_variables + no_condition
 
-    @staticmethod
-    def get_include(tree, name, condition, profile):
+    def get_include(self, tree, name, condition, profile):
         # This function gets an existing <include/>, or creates it
-        for include in tree.findall("include"):
-            if include.attrib.get("name") == name:
-                if condition is None:
-                    return include
+        if self.include_tree is not tree:
+            # Index the includes already in the tree by name, and the conditions of the includes
+            # within them. Includes created here are added as they're created
+            self.include_tree = tree
+            self.include_names = {}
+            self.include_conditions = set()
+            for include in tree.findall("include"):
+                include_name = include.attrib.get("name")
+                if include_name in self.include_names:
+                    continue
 
-                # We've been passed a condition, check there's an include with that
-                # as condition and name as text
+                self.include_names[include_name] = include
                 for vis_include in include.findall("include"):
-                    if vis_include.attrib.get("condition") == condition:
-                        return include
-
-                # We didn't find condition,so create it
-                vis_include = ETree.SubElement(include, "include")
-                vis_include.set("condition", condition)
-                vis_include.text = "%s-%s" % (name, profile)
-
-                return include
-
-        # We didn't find the node, so create it
-        new_include = ETree.SubElement(tree, "include")
-        new_include.set("name", name)
-
-        # If we've been passed a condition, create an include with that as condition
-        # and name as text
-        if condition is not None:
-            vis_include = ETree.SubElement(new_include, "include")
+                    self.include_conditions.add((include_name, vis_include.attrib.get("condition")))
+
+        include = self.include_names.get(name)
+        if include is None:
+            # We didn't find the node, so create it
+            include = ETree.SubElement(tree, "include")
+            include.set("name", name)
+            self.include_names[name] = include
+
+        # If we've been passed a condition, check there's an include with that as condition
+        # and name as text, and create it if there isn't
+        if condition is not None and (name, condition) not in self.include_conditions:
+            vis_include = ETree.SubElement(include, "include")
             vis_include.set("condition", condition)
             vis_include.text = "%s-%s" % (name, profile)
+            self.include_conditions.add((name, condition))
 
-        return new_include
+        return include
 
-    def find_submenu(self, name, level):
-        # Find the correct submenu template
-        return_elem = None
+    def index_template(self):
+        # Index the submenu templates and property groups, so they don't need to be searched for
+        # every menu
         for elem in self.tree.findall("submenu"):
-            # Check if the level matched
-            if level == 0:
-                # No level, so there shouldn't be a level attrib
-                if "level" in elem.attrib:
-                    continue
+            # Submenus without a level attrib are for level 0
+            level = elem.attrib.get("level")
 
+            if "name" in elem.attrib:
+                # The first template with this level and name is the one we want
+                self.named_submenus.setdefault((level, elem.attrib.get("name")), elem)
             else:
-                # There is a level, so make sure there's a level attrib
-                if "level" not in elem.attrib:
-                    continue
-
-                # Make sure the level values match
-                if elem.attrib.get("level") != str(level):
-                    continue
+                # The last template without a name is used if one with the name isn't found
+                self.submenus[level] = elem
 
-            # If there's a name attrib, check if it matches
+        for elem in self.tree.findall("propertyGroup"):
             if "name" in elem.attrib:
-                if elem.attrib.get("name") == name:
-                    # This is the one we want :)
-                    return self.copy_tree(elem)
+                self.property_groups.setdefault(elem.attrib.get("name").lower(), []) \
+                    .extend(elem.findall("property"))
 
-                continue
+    def find_submenu(self, name, level):
+        # Find the correct submenu template
+        submenu_level = None
+        if level != 0:
+            submenu_level = str(level)
 
-            # Save this, in case we don't find a better match
-            return_elem = elem
+        if (submenu_level, name) in self.named_submenus:
+            # This is the one we want :)
+            return self.named_submenus[(submenu_level, name)]
 
-        if return_elem is None:
-            return None
-
-        return self.copy_tree(return_elem)
+        return self.submenus.get(submenu_level)
 
     def find_other(self, item, profile, profile_visibility, simple_visibility, visibility_condition,
                    menu_type, root_id):
@@ -421,6 +439,10 @@ class Template:
         if menu_type != "mainmenu":
             search_type = "submenuOther"
 
+        # Index the item's children by tag, as the conditions and properties of every template are
+        # matched against them
+        children = self.index_children(item)
+
         for elem in self.tree.findall(search_type):
             # Check that we don't already have a template for this include
             include_name = None
@@ -430,7 +452,6 @@ class Template:
             if include_name in found_template_includes:
                 continue
 
-            template = self.copy_tree(elem)
             matched = True
 
             final_visibility = visibility_condition
@@ -457,7 +478,7 @@ class Template:
             # Check whether the skinner has set the match type
             # (whether all conditions need to match, or any)
             match_type = "all"
-            match_elem = template.find("match")
+            match_elem = elem.find("match")
             if match_elem is not None:
                 match_type = match_elem.text.lower()
                 if match_type not in ["any", "all"]:
@@ -468,17 +489,17 @@ class Template:
                     matched = False
 
             # Check the conditions
-            for condition in template.findall("condition"):
+            for condition in elem.findall("condition"):
                 if match_type == "all":
                     if matched is False:
                         break
 
-                    if self.check_condition(condition, item) is False:
+                    if self.check_condition(condition, item, children) is False:
                         matched = False
                         break
 
                 else:
-                    if True in (matched, self.check_condition(condition, item)):
+                    if True in (matched, self.check_condition(condition, item, children)):
                         matched = True
                         break
 
@@ -489,63 +510,59 @@ class Template:
             num_templates += 1
 
             # All the rules matched, so next we'll get any properties
-            properties = self.get_properties(template, item)
+            properties = self.get_properties(elem, item, children)
             if root_id is not None:
                 properties["auto-rootID"] = root_id
 
             # Next up, we do any replacements - EXCEPT for visibility, which
             # we'll store for later (in case multiple items would have an
             # identical template
-            self.replace_elements(template.find("controls"), None, None, [], properties)
-            self.replace_elements(template.find("variables"), None, None, [], properties)
-
-            # Now we need to check if we've already got a template identical to this
-            found_in_previous = False
-            for previous in self.finalize:
-                # Check that the previous template uses the same include
-                include_name_check = include_name
-                if include_name is None:
-                    include_name_check = "NONE"
-
-                if previous.find("skinshortcuts-includeName").text != include_name_check:
-                    continue
-
-                # Compare templates
-                if self.compare_tree(template.find("controls"), previous.find("controls")) and \
-                        self.compare_tree(template.find("variables"), previous.find("variables")):
-                    # They are the same
-
-                    # Add our details to the previous version, so we can build it
-                    # with full visibility details later
-                    for profile_match in previous.findall("skinshortcuts-profile"):
-                        if profile_match.attrib.get("profile") == profile:
-                            # Check if we've already added this visibilityCondition
-                            for visible in profile_match.findall("visible"):
-                                if visible.text == final_visibility:
-                                    # The condition is already there
-                                    found_in_previous = True
-
-                            # We didn't find it, so add it
-                            if not found_in_previous:
-                                ETree.SubElement(profile_match, "visible").text = final_visibility
+            template = self.copy_template(elem, properties)
+
+            # Now we need to check if we've already got a template identical to this, using
+            # the include it's built in and the fingerprints of its controls and variables
+            include_name_check = include_name
+            if include_name is None:
+                include_name_check = "NONE"
+
+            key = (include_name_check, get_fingerprint(template.find("controls")),
+                   get_fingerprint(template.find("variables")))
+            previous = self.finalize.get(key)
+
+            if previous is not None:
+                # They are the same
+
+                # Add our details to the previous version, so we can build it
+                # with full visibility details later
+                found_in_previous = False
+                for profile_match in previous.findall("skinshortcuts-profile"):
+                    if profile_match.attrib.get("profile") == profile:
+                        # Check if we've already added this visibilityCondition
+                        for visible in profile_match.findall("visible"):
+                            if visible.text == final_visibility:
+                                # The condition is already there
                                 found_in_previous = True
 
-                    if found_in_previous is True:
-                        break
+                        # We didn't find it, so add it
+                        if not found_in_previous:
+                            ETree.SubElement(profile_match, "visible").text = final_visibility
+                            found_in_previous = True
 
-                    # We didn't find this profile, so add it
-                    new_element = ETree.SubElement(previous, "skinshortcuts-profile")
-                    new_element.set("profile", profile)
-                    new_element.set("visible", profile_visibility)
+                if found_in_previous is True:
+                    continue
 
-                    # And save the visibility condition
-                    ETree.SubElement(new_element, "visible").text = final_visibility
+                # We didn't find this profile, so add it
+                new_element = ETree.SubElement(previous, "skinshortcuts-profile")
+                new_element.set("profile", profile)
+                new_element.set("visible", profile_visibility)
+
+                # And save the visibility condition
+                ETree.SubElement(new_element, "visible").text = final_visibility
 
-                    # And we're done
-                    found_template_includes.append(include_name)
-                    found_in_previous = True
+                # And we're done
+                found_template_includes.append(include_name)
 
-            if found_in_previous is False:
+            else:
                 # We don't have this template saved, so add our profile details to it
                 new_element = ETree.SubElement(template, "skinshortcuts-profile")
                 new_element.set("profile", profile)
@@ -555,13 +572,10 @@ class Template:
                 ETree.SubElement(new_element, "visible").text = final_visibility
 
                 new_element = ETree.SubElement(template, "skinshortcuts-includeName")
-                if include_name is None:
-                    new_element.text = "NONE"
-                else:
-                    new_element.text = include_name
+                new_element.text = include_name_check
 
                 # Add it to our finalize list
-                self.finalize.append(template)
+                self.finalize[key] = template
 
                 # Add that we've found a template for this include
                 found_template_includes.append(include_name)
@@ -569,7 +583,24 @@ class Template:
         return num_templates
 
     @staticmethod
-    def check_condition(condition, items):
+    def index_children(items):
+        # Index the children of a menu item by their tag
+        children = {}
+        for child in items:
+            children.setdefault(child.tag, []).append(child)
+
+        return children
+
+    @staticmethod
+    def find_children(items, tag, children):
+        # Get the children of an item with a tag, from its children indexed by tag if possible
+        if children is None or not SIMPLE_TAG.fullmatch(tag):
+            return items.findall(tag)
+
+        return children.get(tag, [])
+
+    @staticmethod
+    def check_condition(condition, items, children=None):
         # Check if a particular condition is matched for an 'other' template
         if "tag" not in condition.attrib:
             # Tag attrib is required
@@ -582,7 +613,7 @@ class Template:
             attrib = condition.attrib.get("attribute").split("|")
 
         # Find all elements with matching tag
-        for item in items.findall(tag):
+        for item in Template.find_children(items, tag, children):
             if attrib is not None:
                 if attrib[0] not in item.attrib:
                     # Doesn't have the attribute we're looking for
@@ -601,18 +632,18 @@ class Template:
 
         return False
 
-    def get_properties(self, elem, items):
+    def get_properties(self, elem, items, children=None):
         # Get any properties specified in an 'other' template
         properties = {}
+        if children is None:
+            children = self.index_children(items)
 
         # Start by finding all properties defined directly in the template
         search_properties = elem.findall("property")
 
         # Add any properties defined in a property group
         for property_group in elem.findall("propertyGroup"):
-            for search_group in self.tree.findall("propertyGroup"):
-                if property_group.text.lower() == search_group.attrib.get("name").lower():
-                    search_properties += search_group.findall("property")
+            search_properties += self.property_groups.get(property_group.text.lower(), [])
 
         # Loop through all the properties
         for prop in search_properties:
@@ -700,7 +731,7 @@ class Template:
                     attrib = rule[1]
                     value = rule[2]
 
-                    for item in items.findall(tag):
+                    for item in self.find_children(items, tag, children):
                         if attrib is not None:
                             if attrib[0] not in item.attrib:
                                 # Doesn't have the attribute we're looking for
@@ -741,7 +772,7 @@ class Template:
                     value = rule[2]
                     matched_value = rule
 
-                    for item in items.findall(tag):
+                    for item in self.find_children(items, tag, children):
                         log(repr(attrib))
                         if attrib is not None:
                             if attrib[0] not in item.attrib:
@@ -787,187 +818,160 @@ class Template:
 
         return current_properties
 
-    def replace_elements(self, tree, visibility_condition, profile_visibility, items,
+    def get_program(self, elem):
+        # Compile part of template.xml the first time it's built, so it can then be filled in for
+        # each menu item without searching through it again
+        if elem is None:
+            return None
+
+        program = self.programs.get(elem)
+        if program is None:
+            program = TemplateNode(elem)
+            self.programs[elem] = program
+
+        return program
+
+    def replace_elements(self, program, visibility_condition, profile_visibility, items, *,
                          properties=None, customitems=None):
+        # Build the children of a compiled element, with all <skinshortcuts> elements and
+        # $SKINSHORTCUTS/$PYTHON values replaced
         if properties is None:
             properties = {}
 
-        if tree is None:
-            return
+        if program is None:
+            return []
 
-        for elem in tree:
-            # <tag skinshortcuts="visible" /> -> <tag condition="[condition]" />
-            if "skinshortcuts" in elem.attrib:
-                # Get index of the element
-                index = list(tree).index(elem)
-
-                # Get existing attributes, text and tag
-                attribs = []
-                item_type = ""
-                for single_attrib in elem.attrib:
-                    if single_attrib == "skinshortcuts":
-                        item_type = elem.attrib.get("skinshortcuts")
-                    else:
-                        attribs.append((single_attrib, elem.attrib.get(single_attrib)))
+        if program.static:
+            return [self.copy_tree(child) for child in program.element]
+
+        return self.render_elements(program.children, visibility_condition, profile_visibility,
+                                    items, properties=properties, customitems=customitems)
+
+    def render_elements(self, nodes, visibility_condition, profile_visibility, items, *,
+                        properties, customitems):
+        # This matches replacing the elements in a copy of the template one at a time, so an
+        # element which is removed without replacement leaves the next one as it is, and
+        # any elements after the first inserted in its place are replaced as well
+        new_elements = []
 
-                text = elem.text
-                tag = elem.tag
+        # Elements inserted into the template are queued along with the node compiled from them
+        # (None if there's nothing to replace), so they aren't copied again
+        nodes = deque((node, None) for node in nodes)
+        while nodes:
+            node, inserted = nodes.popleft()
 
+            if node is None or node.static:
+                new_elements.append(self.copy_node(node, inserted))
+                continue
+
+            # <tag skinshortcuts="visible" /> -> <tag condition="[condition]" />
+            if node.item_type is not None:
                 # Don't continue is item_type = visibility, and no visibilityCondition
-                if item_type == "visibility" and visibility_condition is None:
+                if node.item_type == "visibility" and visibility_condition is None:
+                    new_elements.append(self.copy_node(node, inserted))
                     continue
 
-                # Remove the existing element
-                tree.remove(elem)
-
                 # Make replacement element
-                new_element = ETree.Element(tag)
-                if text is not None:
-                    new_element.text = text
+                new_element = ETree.Element(node.tag)
+                if node.element.text is not None:
+                    new_element.text = node.element.text
 
-                for single_attrib in attribs:
-                    new_element.set(single_attrib[0], single_attrib[1])
+                for single_attrib, value in node.element.attrib.items():
+                    if single_attrib != "skinshortcuts":
+                        new_element.set(single_attrib, value)
 
                 # Make replacements
-                if item_type == "visibility" and visibility_condition is not None:
+                if node.item_type == "visibility":
                     new_element.set("condition", visibility_condition)
 
-                # Insert it
-                tree.insert(index, new_element)
+                new_elements.append(new_element)
+                continue
 
             # <tag>$skinshortcuts[var]</tag> -> <tag>[value]</tag>
-            # <tag>$skinshortcuts[var]</tag> ->
-            # <tag><include>[includeName]</include></tag> (property = $INCLUDE[includeName])
-            if elem.text is not None:
-                while "$SKINSHORTCUTS[" in elem.text:
-                    # Split the string into its composite parts
-                    string_start = elem.text.split("$SKINSHORTCUTS[", 1)
-                    string_end = string_start[1].split("]", 1)
-                    # string_start[ 0 ] = Any code before the $SKINSHORTCUTS property
-                    # string_end[ 0 ] = The name of the $SKINSHORTCUTS property
-                    # string_end[ 1 ] = Any code after the $SKINSHORTCUTS property
-
-                    if string_end[0] in properties:
-                        if properties[string_end[0]].startswith("$INCLUDE["):
-                            # Remove text property
-                            elem.text = ""
-                            # Add include element
-                            include_element = ETree.SubElement(elem, "include")
-                            include_element.text = properties[string_end[0]][9:-1]
-
-                        else:
-                            elem.text = string_start[0] + properties[string_end[0]] + string_end[1]
-
-                    else:
-                        elem.text = string_start[0] + string_end[1]
-
             # <tag attrib="$skinshortcuts[var]" /> -> <tag attrib="[value]" />
-            for attrib in elem.attrib:
-                value = elem.attrib.get(attrib)
-                while "$SKINSHORTCUTS[" in elem.attrib.get(attrib):
-                    # Split the string into its composite parts
-                    string_start = elem.attrib.get(attrib).split("$SKINSHORTCUTS[", 1)
-                    string_end = string_start[1].split("]", 1)
-
-                    if string_end[0] in properties:
-                        elem.set(attrib,
-                                 string_start[0] + properties[string_end[0]] + string_end[1])
-                    else:
-                        elem.set(attrib, string_start[0] + string_end[1])
-
-                if value.startswith("$SKINSHORTCUTS[") and value[15:-1] in properties:
-                    new_value = ""
-                    if value[15:-1] in properties:
-                        new_value = properties[value[15:-1]]
-                    elem.set(attrib, new_value)
-
             # <tag>$PYTHON[var]</tag> -> <tag>[result]</tag>
-            if elem.text is not None:
-                while "$PYTHON[" in elem.text:
-                    # Split the string into its composite parts
-                    string_start = elem.text.split("$PYTHON[", 1)
-                    string_end = string_start[1].split("]", 1)
-                    # string_start[ 0 ] = Any code before the $MATHS property
-                    # string_end[ 0 ] = The maths to be performed
-                    # string_end[ 1 ] = Any code after the $MATHS property
-
-                    string_end[0] = simple_eval("%s" % (string_end[0]), names=properties)
+            text, include = node.render_text(properties)
+            elem = ETree.Element(node.tag, node.render_attribs(properties))
+            elem.text = text
+            elem.tail = node.element.tail
 
-                    elem.text = string_start[0] + str(string_end[0]) + string_end[1]
-
-            # <tag attrib="$PYTHON[var]" /> -> <tag attrib="[value]" />
-            for attrib in elem.attrib:
-                _ = elem.attrib.get(attrib)
-                while "$PYTHON[" in elem.attrib.get(attrib):
-                    # Split the string into its composite parts
-                    string_start = elem.attrib.get(attrib).split("$PYTHON[", 1)
-                    string_end = string_start[1].split("]", 1)
-
-                    string_end[0] = simple_eval("%s" % (string_end[0]), names=properties)
-
-                    elem.set(attrib, string_start[0] + str(string_end[0]) + string_end[1])
+            children = node.children
+            if include is not None:
+                include_element = ETree.Element("include")
+                include_element.text = include
+                children = children + [TemplateNode(include_element)]
 
             # <skinshortcuts>visible</skinshortcuts> -> <visible>[condition]</visible>
             # <skinshortcuts>items</skinshortcuts> -> <item/><item/>...
-            if elem.tag == "skinshortcuts":
-                # Get index of the element
-                index = list(tree).index(elem)
-
-                # Get the item_type of replacement
-                item_type = elem.text
-
-                # Don't continue is item_type = visibility, and no visibilityCondition
-                if item_type == "visibility" and visibility_condition is None:
-                    continue
+            if node.tag != "skinshortcuts":
+                # Iterate through tree
+                elem.extend(self.render_elements(children, visibility_condition,
+                                                 profile_visibility, items,
+                                                 properties=properties,
+                                                 customitems=customitems))
+                new_elements.append(elem)
+                continue
 
-                # Remove the existing element
-                tree.remove(elem)
+            # Get the item_type of replacement
+            item_type = elem.text
 
-                # Make replacements
-                if item_type == "visibility" and visibility_condition is not None:
-                    # Create a new visible element
-                    newelement = ETree.Element("visible")
-                    newelement.text = visibility_condition
-                    # Insert it
-                    tree.insert(index, newelement)
-
-                elif item_type == "items" and customitems is not None and \
-                        elem.attrib.get("insert"):
-                    for element in self.build_submenu_custom_items(customitems,
-                                                                   items.findall("item"),
-                                                                   elem.attrib.get("insert"),
-                                                                   properties):
-                        for child in element:
-                            tree.insert(index, child)
-
-                elif item_type == "items":
-                    # Firstly, go through and create an array of all items in reverse order, without
-                    # their existing visible element, if it matches our visibilityCondition
-                    newelements = []
-                    if not items:
-                        break
+            # Don't continue is item_type = visibility, and no visibilityCondition
+            if item_type == "visibility" and visibility_condition is None:
+                for child in children:
+                    elem.append(self.copy_tree(child.element))
+                new_elements.append(elem)
+                continue
 
-                    for item in items.findall("item"):
-                        newitem = self.copy_tree(item)
+            # Make replacements
+            new_items = []
+            if item_type == "visibility":
+                # Create a new visible element
+                newelement = ETree.Element("visible")
+                newelement.text = visibility_condition
+                new_items.append(newelement)
+
+            elif item_type == "items" and customitems is not None and elem.attrib.get("insert"):
+                for element in self.build_submenu_custom_items(customitems,
+                                                               items.findall("item"),
+                                                               elem.attrib.get("insert"),
+                                                               properties):
+                    for child in element:
+                        new_items.insert(0, child)
+
+            elif item_type == "items":
+                # Create an array of all items, without their existing visible element, if it
+                # matches our visibilityCondition
+                if len(items) == 0:
+                    # Leave the rest of the elements as they are
+                    for node, inserted in nodes:
+                        new_elements.append(self.copy_node(node, inserted))
+                    break
+
+                for item in items.findall("item"):
+                    newitem = self.copy_tree(item)
+
+                    # Remove the existing visible elem from this
+                    for visibility in newitem.findall("visible"):
+                        if visibility.text != profile_visibility:
+                            continue
+                        newitem.remove(visibility)
 
-                        # Remove the existing visible elem from this
-                        for visibility in newitem.findall("visible"):
-                            if visibility.text != profile_visibility:
-                                continue
-                            newitem.remove(visibility)
+                    new_items.append(newitem)
 
-                        # Add a copy to the array
-                        newelements.insert(0, newitem)
+            if len(new_items) == 0:
+                # The next element isn't replaced
+                if nodes:
+                    new_elements.append(self.copy_node(*nodes.popleft()))
+                continue
 
-                    if len(newelements) != 0:
-                        for element in newelements:
-                            # Insert them into the template
-                            tree.insert(index, element)
+            new_elements.append(new_items[0])
+            for element in reversed(new_items[1:]):
+                if is_static(element):
+                    nodes.appendleft((None, element))
+                else:
+                    nodes.appendleft((TemplateNode(element), element))
 
-            else:
-                # Iterate through tree
-                self.replace_elements(elem, visibility_condition, profile_visibility, items,
-                                      properties, customitems=customitems)
+        return new_elements
 
     def build_submenu_custom_items(self, template, items, insert, current_properties):
         # Builds an 'items' template within a submenu template
@@ -984,16 +988,43 @@ class Template:
             return []
 
         newelements = []
+        program = self.get_program(item_template.find("controls"))
         for item in items:
-            new_element = self.copy_tree(item_template.find("controls"))
-            self.replace_elements(
-                new_element, None, None, [],
-                self.combine_properties(item_template, item, current_properties.copy())
-            )
-            newelements.insert(0, new_element)
+            newelements.insert(0, self.replace_elements(
+                program, None, None, [],
+                properties=self.combine_properties(item_template, item,
+                                                   current_properties.copy())
+            ))
 
         return newelements
 
+    def copy_template(self, elem, properties):
+        # Copy an 'other' template, with the properties replaced in its controls and variables
+        controls = elem.find("controls")
+        variables = elem.find("variables")
+
+        template = ETree.Element(elem.tag, elem.attrib)
+        template.text = elem.text
+        template.tail = elem.tail
+        for child in elem:
+            if child is controls or child is variables:
+                new_child = ETree.SubElement(template, child.tag, child.attrib)
+                new_child.text = child.text
+                new_child.tail = child.tail
+                new_child.extend(self.replace_elements(self.get_program(child), None, None, [],
+                                                       properties=properties))
+            else:
+                template.append(self.copy_tree(child))
+
+        return template
+
+    def copy_node(self, node, inserted):
+        # Elements inserted while building the template are already copies
+        if inserted is not None:
+            return inserted
+
+        return self.copy_tree(node.element)
+
     def copy_tree(self, elem):
         if elem is None:
             return None
@@ -1006,27 +1037,3 @@ class Template:
             ret.append(self.copy_tree(child))
 
         return ret
-
-    def compare_tree(self, element_1, element_2):
-        if element_1 is None and element_2 is None:
-            return True
-
-        if element_1 is None or element_2 is None:
-            return False
-
-        if element_1.tag != element_2.tag:
-            return False
-
-        if element_1.text != element_2.text:
-            return False
-
-        if element_1.tail != element_2.tail:
-            return False
-
-        if element_1.attrib != element_2.attrib:
-            return False
-
-        if len(element_1) != len(element_2):
-            return False
-
-        return all(self.compare_tree(c1, c2) for c1, c2 in zip(element_1, element_2))
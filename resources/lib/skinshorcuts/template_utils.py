@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+    Copyright (C) 2013-2021 Skin Shortcuts (script.skinshortcuts)
+    This file is part of script.skinshortcuts
+    SPDX-License-Identifier: GPL-2.0-only
+    See LICENSES/GPL-2.0-only.txt for more information.
+"""
+
+import ast
+
+from simpleeval import SimpleEval
+
+PROPERTY_MARKER = "$SKINSHORTCUTS["
+PYTHON_MARKER = "$PYTHON["
+INCLUDE_MARKER = "$INCLUDE["
+
+# $PYTHON[] expressions are parsed once, then evaluated against the properties of each item
+PYTHON_CACHE = {
+    "evaluator": SimpleEval(),
+    "expressions": {},
+    "hits": 0,
+    "misses": 0
+}
+
+
+class TemplateString:
+    # A string from template.xml, split into the static fragments either side of each
+    # $SKINSHORTCUTS[name], so it can be filled in without searching through it every time
+    __slots__ = ("value", "fragments", "names", "whole_name")
+
+    def __init__(self, value):
+        self.value = value
+        self.fragments = None
+        self.names = []
+
+        # <tag attrib="$SKINSHORTCUTS[name]" /> is set to the value of the property as it is
+        self.whole_name = None
+        if value.startswith(PROPERTY_MARKER):
+            self.whole_name = value[15:-1]
+
+        fragments = []
+        remaining = value
+        while PROPERTY_MARKER in remaining:
+            string_start, string_end = remaining.split(PROPERTY_MARKER, 1)
+            if "]" not in string_end:
+                # Leave this for replace_properties to deal with
+                self.names = None
+                return
+
+            name, remaining = string_end.split("]", 1)
+            fragments.append(string_start)
+            self.names.append(name)
+
+        fragments.append(remaining)
+        self.fragments = fragments
+
+    def render(self, properties, includes=False):
+        # Returns the string with its properties filled in and, if includes is True, the name of
+        # the include the first property set to $INCLUDE[name] is replaced with
+        if self.names is None:
+            return replace_properties(self.value, properties, includes)
+
+        include = None
+        parts = [self.fragments[0]]
+        for name, fragment in zip(self.names, self.fragments[1:]):
+            if name in properties:
+                value = properties[name]
+                if includes and include is None and value.startswith(INCLUDE_MARKER):
+                    include = value[9:-1]
+                parts.append(value)
+
+            parts.append(fragment)
+
+        text = "".join(parts)
+        if PROPERTY_MARKER in text:
+            # A property has added another property to replace
+            return replace_properties(self.value, properties, includes)
+
+        if include is not None:
+            return "", include
+
+        return text, None
+
+
+class TemplateNode:
+    # An element from template.xml, with everything Template.render_elements needs to fill it in
+    # worked out in advance. Static nodes don't contain anything to replace, so they're just copied
+    __slots__ = ("element", "tag", "item_type", "text", "attribs", "children", "static")
+
+    def __init__(self, element):
+        self.element = element
+        self.tag = element.tag
+
+        self.item_type = None
+        self.text = None
+        self.attribs = []
+        self.children = []
+        self.static = is_static(element)
+        if self.static:
+            return
+
+        # The value of a skinshortcuts attribute, if there is one
+        self.item_type = element.attrib.get("skinshortcuts")
+
+        if element.text is not None and \
+                (PROPERTY_MARKER in element.text or PYTHON_MARKER in element.text):
+            self.text = TemplateString(element.text)
+
+        for name, value in element.attrib.items():
+            if PROPERTY_MARKER in value or PYTHON_MARKER in value:
+                self.attribs.append((name, TemplateString(value)))
+
+        self.children = [TemplateNode(child) for child in element]
+
+    def render_text(self, properties):
+        # Returns the text and the name of any include that replaces it
+        if self.text is None:
+            return self.element.text, None
+
+        text, include = self.text.render(properties, includes=True)
+        if include is None and PYTHON_MARKER in text:
+            text = replace_python(text, properties)
+
+        return text, include
+
+    def render_attribs(self, properties):
+        attribs = dict(self.element.attrib)
+        for name, value in self.attribs:
+            attribs[name] = value.render(properties)[0]
+            if value.whole_name is not None and value.whole_name in properties:
+                attribs[name] = properties[value.whole_name]
+
+        for name, _ in self.attribs:
+            if PYTHON_MARKER in attribs[name]:
+                attribs[name] = replace_python(attribs[name], properties)
+
+        return attribs
+
+
+def get_fingerprint(element):
+    # Elements have the same fingerprint if their tags, text, tails, attributes and children
+    # are all the same
+    if element is None:
+        return None
+
+    return (element.tag, element.text, element.tail, tuple(sorted(element.attrib.items())),
+            tuple(get_fingerprint(child) for child in element))
+
+
+def is_static(element):
+    # Whether an element contains anything for Template.render_elements to replace, without
+    # compiling it
+    for elem in element.iter():
+        if elem.tag == "skinshortcuts" or "skinshortcuts" in elem.attrib:
+            return False
+
+        for value in (elem.text, *elem.attrib.values()):
+            if value is not None and (PROPERTY_MARKER in value or PYTHON_MARKER in value):
+                return False
+
+    return True
+
+
+def replace_properties(value, properties, includes=False):
+    # <tag>$skinshortcuts[var]</tag> -> <tag>[value]</tag>
+    # <tag>$skinshortcuts[var]</tag> ->
+    # <tag><include>[includeName]</include></tag> (property = $INCLUDE[includeName])
+    while PROPERTY_MARKER in value:
+        # Split the string into its composite parts
+        string_start = value.split(PROPERTY_MARKER, 1)
+        string_end = string_start[1].split("]", 1)
+        # string_start[ 0 ] = Any code before the $SKINSHORTCUTS property
+        # string_end[ 0 ] = The name of the $SKINSHORTCUTS property
+        # string_end[ 1 ] = Any code after the $SKINSHORTCUTS property
+
+        if string_end[0] in properties:
+            if includes and properties[string_end[0]].startswith(INCLUDE_MARKER):
+                return "", properties[string_end[0]][9:-1]
+
+            value = string_start[0] + properties[string_end[0]] + string_end[1]
+
+        else:
+            value = string_start[0] + string_end[1]
+
+    return value, None
+
+
+def replace_python(value, properties):
+    # <tag>$PYTHON[var]</tag> -> <tag>[result]</tag>
+    while PYTHON_MARKER in value:
+        # Split the string into its composite parts
+        string_start = value.split(PYTHON_MARKER, 1)
+        string_end = string_start[1].split("]", 1)
+        # string_start[ 0 ] = Any code before the $PYTHON property
+        # string_end[ 0 ] = The maths to be performed
+        # string_end[ 1 ] = Any code after the $PYTHON property
+
+        string_end[0] = evaluate_python(string_end[0], properties)
+
+        value = string_start[0] + str(string_end[0]) + string_end[1]
+
+    return value
+
+
+def evaluate_python(expression, properties):
+    # Equivalent to simple_eval(expression, names=properties), without parsing the expression or
+    # setting up a new evaluator every time
+    parsed = PYTHON_CACHE["expressions"].get(expression)
+    if parsed is None:
+        PYTHON_CACHE["misses"] += 1
+        parsed = ast.parse(expression.strip()).body[0]
+        PYTHON_CACHE["expressions"][expression] = parsed
+    else:
+        PYTHON_CACHE["hits"] += 1
+
+    # The parsed expression is still only evaluated by SimpleEval, so the same operators,
+    # functions and nodes are allowed
+    evaluator = PYTHON_CACHE["evaluator"]
+    evaluator.names = properties
+    evaluator.expr = expression
+    return evaluator._eval(parsed)  # pylint: disable=protected-access
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+    Copyright (C) 2013-2021 Skin Shortcuts (script.skinshortcuts)
+    This file is part of script.skinshortcuts
+    SPDX-License-Identifier: GPL-2.0-only
+    See LICENSES/GPL-2.0-only.txt for more information.
+"""
+
+import io
+from xml.sax.saxutils import escape
+
+ATTRIB_ENTITIES = {
+    '"': '&quot;',
+    '\r': '&#13;',
+    '\n': '&#10;',
+    '\t': '&#09;',
+}
+
+
+def serialize_xml(root):
+    # Serialize an element and its children to UTF-8, indenting them as they're written
+    # (the output is the same as DataFunctions.indent followed by ElementTree.write, without
+    # having to walk the tree twice or modify it)
+    buffer = io.StringIO()
+    buffer.write("<?xml version='1.0' encoding='UTF-8'?>\n")
+    _write_element(buffer.write, root)
+    return buffer.getvalue().encode('utf-8', 'xmlcharrefreplace')
+
+
+def _write_element(write, elem, level=0):
+    whitespace = "\n%s" % (level * "\t")
+
+    write("<%s" % elem.tag)
+    for key, value in elem.attrib.items():
+        write(' %s="%s"' % (key, escape(value, ATTRIB_ENTITIES)))
+
+    tail = elem.tail
+    if len(elem):
+        text = elem.text
+        if not text or not text.strip():
+            text = "%s%s" % (whitespace, "\t")
+
+        write(">%s" % escape(text))
+        for child in elem:
+            _write_element(write, child, level + 1)
+
+        write("</%s>" % elem.tag)
+
+        if not tail or not tail.strip():
+            tail = whitespace
+
+    else:
+        if elem.text:
+            write(">%s</%s>" % (escape(elem.text), elem.tag))
+        else:
+            write(" />")
+
+        if level and (not tail or not tail.strip()):
+            tail = whitespace
+
+    if tail:
+        write(escape(tail))
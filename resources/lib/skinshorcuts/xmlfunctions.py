@@ -6,7 +6,6 @@
     See LICENSES/GPL-2.0-only.txt for more information.
 """
 
-import ast
 import os
 import re
 import xml.etree.ElementTree as ETree
@@ -20,6 +19,7 @@ from . import datafunctions
 from . import template
 from .common import log
 from .common import read_file
+from .common import write_file
 from .common_utils import disable_logging
 from .common_utils import enable_logging
 from .common_utils import offer_log_upload
@@ -29,17 +29,29 @@ from .constants import ADDON_VERSION
 from .constants import HOME_WINDOW
 from .constants import KODI_VERSION
 from .constants import LANGUAGE
+from .constants import PROPERTIES_FILE
 from .constants import SKIN_DIR
 from .constants import SKIN_PATH
 from .hash_utils import generate_file_hash
+from .hash_utils import generate_file_hashes
+from .hash_utils import generate_file_stat
+from .hash_utils import generate_hash
 from .hash_utils import read_hashes
 from .hash_utils import write_hashes
+from .property_utils import get_additional_properties
 from .property_utils import has_fallback_property
+from .property_utils import hash_properties
+from .template_utils import PYTHON_CACHE
+from .xml_utils import serialize_xml
 
 
 class XMLFunctions:
     def __init__(self):
         self.data_func = datafunctions.DataFunctions()
+        # Nothing writes .DATA.xml files or properties during a build, so list each directory
+        # and process each skin and script .DATA.xml file once
+        self.data_func.directory_snapshots = {}
+        self.data_func.processed_shortcuts = {}
 
         self.main_widget = {}
         self.main_background = {}
@@ -54,6 +66,18 @@ class XMLFunctions:
 
         self.check_for_shortcuts = []
 
+        # Details of the previous build, filled in by shouldwerun and used to decide
+        # whether the menu can be updated incrementally
+        self.hashes = []
+        self.dependencies = None
+        self.file_hashes = {}
+        self.file_stats = {}
+        self.changed_files = set()
+        self.menu_edited = False
+
+        # Whether writing the menu changed any includes file, and the skin needs reloading
+        self.includes_changed = False
+
     def build_menu(self, mainmenu_id, groups, num_levels, build_mode, options, minitems,
                    system_debug=False, script_debug=False):
         # Entry point for building includes.xml files
@@ -106,8 +130,11 @@ class XMLFunctions:
 
         # Write the menus
         try:
-            self.writexml(profilelist, mainmenu_id, groups, num_levels, build_mode,
-                          progress, options, minitems)
+            if not self.writexml_incremental(profilelist, mainmenu_id, groups, num_levels,
+                                             build_mode, progress=progress, options=options,
+                                             minitems=minitems):
+                self.writexml(profilelist, mainmenu_id, groups, num_levels, build_mode,
+                              progress, options, minitems)
             complete = True
         except:
             log(print_exc())
@@ -118,9 +145,17 @@ class XMLFunctions:
         HOME_WINDOW.clearProperty("skinshortcuts-isrunning")
         progress.close()
 
+        log("Slugify cache: %d hits, %d misses" %
+            (self.data_func.slugify_hits, self.data_func.slugify_misses))
+        log("$PYTHON[] expression cache: %d hits, %d misses" %
+            (PYTHON_CACHE["hits"], PYTHON_CACHE["misses"]))
+
         if complete:
-            # Menu is built, reload the skin
-            xbmc.executebuiltin("ReloadSkin()")
+            # Menu is built, reload the skin if the includes have changed
+            if self.includes_changed:
+                xbmc.executebuiltin("ReloadSkin()")
+            else:
+                log("Menu is unchanged, not reloading the skin")
             return
 
         # Menu couldn't be built - generate a debug log
@@ -140,14 +175,14 @@ class XMLFunctions:
         else:
             offer_log_upload(message_id=32092)
 
-    @staticmethod
-    def shouldwerun(profilelist):
+    def shouldwerun(self, profilelist):
         try:
             prop = HOME_WINDOW.getProperty("skinshortcuts-reloadmainmenu")
             HOME_WINDOW.clearProperty("skinshortcuts-reloadmainmenu")
             if prop == "True":
+                # Carry on checking the hashes, so we know which files the edit touched
                 log("Menu has been edited")
-                return True
+                self.menu_edited = True
         except:
             pass
 
@@ -189,6 +224,8 @@ class XMLFunctions:
             log("No hashes found")
             return True
 
+        self.hashes = hashes
+
         checked_kodi_ver = False
         checked_skin_ver = False
         checked_script_ver = False
@@ -196,13 +233,19 @@ class XMLFunctions:
         checked_pvr_vis = False
         checked_shared_menu = False
         found_full_menu = False
+        dependencies = None
+        unverified = []
 
         for hashed in hashes:
             hashed_item = '' if not hashed else hashed[0]
             hashed_value = '' if len(hashed) < 2 else hashed[1]
+            hashed_stat = None if len(hashed) < 3 else hashed[2]
 
-            log("Comparing hashes of Item: %s Value: %s" %
-                (hashed_item, hashed_value))
+            if hashed_item == "::DEPENDENCIES::":
+                log("Comparing hashes of Item: %s" % hashed_item)
+            else:
+                log("Comparing hashes of Item: %s Value: %s" %
+                    (hashed_item, hashed_value))
 
             if hashed_value is not None:
                 if hashed_item == "::XBMCVER::":
@@ -265,24 +308,50 @@ class XMLFunctions:
                     # Used to import menus from one skin to another, nothing to check here
                     pass
 
+                elif hashed_item == "::DEPENDENCIES::":
+                    # Which files fed which groups, used for incremental rebuilds
+                    dependencies = hashed_value
+
                 else:
-                    try:
-                        hexdigest = generate_file_hash(hashed_item)
-                        if hexdigest != hashed_value:
-                            log("Hash does not match for Filename: %s "
-                                "Stored Hash: %s Actual Hash: %s" %
-                                (hashed_item, hashed_value, hexdigest))
-                            return True
-                    except:
-                        item = 'UNKNOWN' if not hashed_item else hashed_item
-                        value = 'UNKNOWN' if hashed_value == '' else hashed_value
-                        log("Failed to compare hash of Item: %s Value: %s" %
-                            (item, value))
+                    # Only hash the file if its size, modification time or inode have changed
+                    stat = generate_file_stat(hashed_item)
+                    self.file_stats[hashed_item] = stat
+                    if stat is not None and stat == hashed_stat:
+                        self.file_hashes[hashed_item] = hashed_value
+                    else:
+                        unverified.append(hashed)
 
             if hashed_value is None:
                 if xbmcvfs.exists(hashed_item):
                     log("New file detected %s" % hashed_item)
-                    return True
+                    self.changed_files.add(hashed_item)
+                else:
+                    # Still doesn't exist
+                    self.file_hashes[hashed_item] = None
+
+        # Hash all the files whose stat signature has changed together
+        restatted = False
+        hexdigests = generate_file_hashes([hashed[0] for hashed in unverified])
+        for hashed, hexdigest in zip(unverified, hexdigests):
+            hashed_item, hashed_value = hashed[0], hashed[1]
+            self.file_hashes[hashed_item] = hexdigest
+            if hexdigest != hashed_value:
+                log("Hash does not match for Filename: %s Stored Hash: %s Actual Hash: %s" %
+                    (hashed_item, hashed_value, hexdigest))
+                # Keep going, so we have the full list of changed files
+                self.changed_files.add(hashed_item)
+
+            elif self.file_stats[hashed_item] is not None:
+                # The file hasn't changed, but its stat signature is new. This happens to files
+                # written just before they were hashed, like the includes files, as their stat
+                # couldn't be trusted then. Save it, so the file doesn't need hashing next time
+                hashed[2:] = [self.file_stats[hashed_item]]
+                restatted = True
+
+        if self.menu_edited or len(self.changed_files) != 0:
+            # We've checked every hash, so the list of changed files is complete
+            self.dependencies = dependencies
+            return True
 
         # Set or clear the FullMenu skin bool
         if found_full_menu:
@@ -297,6 +366,9 @@ class XMLFunctions:
             return True
 
         # If we get here, the menu does not need to be rebuilt.
+        if restatted:
+            write_hashes(hashes)
+
         return False
 
     # noinspection PyListCreation
@@ -311,13 +383,22 @@ class XMLFunctions:
         hashlist.append(["::SHARED::", ADDON.getSetting("shared_menu")])
         hashlist.append(["::SKINDIR::", SKIN_DIR])
 
+        # Track which files feed which submenu groups, so a later build can just
+        # regenerate the groups whose files have changed
+        dependencies = {
+            "arguments": [mainmenu_id, groups, num_levels, build_mode, options, minitems],
+            "groups": {},
+            "files": {},
+            "properties": {},
+            "submenus": [[] for _ in range(0, int(num_levels) + 1)]
+        }
+
         # Clear any skin settings for backgrounds and widgets
         self.data_func.reset_backgroundandwidgets()
         self.widget_count = 1
 
         # Create a new tree and includes for the various groups
-        tree = ETree.ElementTree(ETree.Element("includes"))
-        root = tree.getroot()
+        root = ETree.Element("includes")
 
         # Create a Template object and pass it the root
         temple_object = template.Template()
@@ -364,6 +445,13 @@ class XMLFunctions:
 
         submenu_nodes = {}
 
+        # Clear any previously loaded additional properties. The properties file is the
+        # same for every profile we build, so it's only loaded once for all of them
+        self.data_func.current_properties = None
+
+        # Each profile has its own user .DATA.xml files, so its items are still loaded and built
+        # separately. Only the properties, and processed skin and script .DATA.xml files, are
+        # shared between profiles
         for profile in profilelist:
             log("Building menu for profile %s" % (profile[2]))
             # Load profile details
@@ -384,9 +472,6 @@ class XMLFunctions:
             # Clear any previous labelID's
             self.data_func.clear_label_id()
 
-            # Clear any additional properties, which may be for a different profile
-            self.data_func.current_properties = None
-
             # Create objects to hold the items
             menuitems = []
             submenu_items = []
@@ -505,14 +590,7 @@ class XMLFunctions:
                             justmenu_tree_a = ETree.SubElement(root, "include")
                             justmenu_tree_b = ETree.SubElement(root, "include")
 
-                            if count != 0:
-                                group_include = \
-                                    "%s-%s" % \
-                                    (self.data_func.slugify(submenu[:-2], convert_int=True),
-                                     submenu[-1:])
-                            else:
-                                group_include = self.data_func.slugify(submenu, convert_int=True)
-
+                            group_include = self.get_group_include(submenu, count)
                             justmenu_tree_a.set("name",
                                                 "skinshortcuts-group-%s" % group_include)
                             justmenu_tree_b.set("name",
@@ -523,18 +601,35 @@ class XMLFunctions:
                     itemidsubmenu = 0
 
                     # Get the shortcuts for the submenu
+                    default_group = None
                     if count == 0:
-                        submenudata = self.data_func.get_shortcuts(submenu, submenu_default_id,
-                                                                   profile[0])
-                    else:
-                        submenudata = self.data_func.get_shortcuts(submenu, None,
-                                                                   profile[0], is_sub_level=True)
+                        default_group = submenu_default_id
+
+                    submenudata = self.data_func.get_shortcuts(submenu, default_group, profile[0],
+                                                               is_sub_level=count != 0)
 
                     if isinstance(submenudata, list):
                         submenuitems = submenudata
                     else:
                         submenuitems = submenudata.findall("shortcut")
 
+                    group_dependencies = None
+                    if not isinstance(item, str):
+                        # Save the files this submenu was built from
+                        group_dependencies = {
+                            "level": count,
+                            "mainmenu": submenu_visibility_name,
+                            "empty": len(submenuitems) == 0,
+                            "skinbools": []
+                        }
+                        dependencies["groups"][submenu] = group_dependencies
+                        for path in self.data_func.get_shortcuts_paths(submenu, default_group,
+                                                                       profile[0],
+                                                                       is_sub_level=count != 0):
+                            dependent_groups = dependencies["files"].setdefault(path, [])
+                            if submenu not in dependent_groups:
+                                dependent_groups.append(submenu)
+
                     # Are there any submenu items for the main menu?
                     if count == 0:
                         if len(submenuitems) != 0:
@@ -607,6 +702,9 @@ class XMLFunctions:
                         is_submenu_element.set("name", "isSubmenu")
                         is_submenu_element.text = "True"
 
+                        if group_dependencies is not None:
+                            group_dependencies["skinbools"] += self.get_skin_bools(all_props)
+
                         # Save a copy for the template
                         template_submenu_items.append(temple_object.copy_tree(menuitem))
 
@@ -659,6 +757,11 @@ class XMLFunctions:
                                                         convert_int=True))
                             )
                         submenu_tree.append(menu_item_copy)
+
+                    # Save how many items each group added to the submenu include, in order.
+                    # (Disabled items don't have a group property, so we can't search for them)
+                    dependencies["submenus"][count].append([submenu, len(submenuitems)])
+
                     if len(submenuitems) == 0 and "noGroups" not in options:
                         # There aren't any submenu items, so add a 'description'
                         # element to the group includes
@@ -736,20 +839,321 @@ class XMLFunctions:
 
         progress.update(100, message=LANGUAGE(32098))
 
-        # Get the skins addon.xml file
-        addon_xml = xbmcvfs.translatePath(os.path.join("special://skin/", 'addon.xml'))
-        addon = ETree.parse(addon_xml)
-        extensionpoints = addon.findall("extension")
-
-        skin_version = addon.getroot().attrib.get("version")
+        # Get the skin version and the includes files we'll be writing
+        skin_version, paths = self.get_includes_paths()
         # Append the skin version to the hashlist
         hashlist.append(["::SKINVER::", skin_version])
 
-        # indent the tree
-        self.data_func.indent(tree.getroot())
+        # Save the properties each group was built with
+        for group_dependencies in dependencies["groups"].values():
+            group_dependencies["skinbools"] = sorted(set(group_dependencies["skinbools"]))
+        dependencies["properties"] = hash_properties()
+        hashlist.append(["::DEPENDENCIES::", dependencies])
+
+        # writing includes, all resolutions share the same hash
+        hexdigest = self.write_includes(root, paths)
+        for path in paths:
+            hashlist.append([path, hexdigest, generate_file_stat(path)])
 
         # create a set of hashable files
         hashable = set()
+        hashable.update(self.data_func.hashable)
+        hashable.update(temple_object.hashable)
+
+        # generate a hash for all paths, in a stable order
+        # (stat before hashing, so later changes aren't missed)
+        hashable = sorted(hashable)
+        stats = [generate_file_stat(item) for item in hashable]
+        for item, stat, hexdigest in zip(hashable, stats, generate_file_hashes(hashable)):
+            if hexdigest:
+                hashlist.append([item, hexdigest, stat])
+            else:
+                # Save files which don't exist too, so we notice if they're created
+                hashlist.append([item, None])
+
+        # Save the hashes
+        write_hashes(hashlist)
+
+    def writexml_incremental(self, profilelist, mainmenu_id, groups, num_levels, build_mode, *,
+                             progress, options, minitems):
+        # Regenerate just the submenu groups whose files have changed since the last build,
+        # and splice them into the existing includes file.
+        # Returns False if the full menu needs to be rebuilt instead
+        try:
+            changed_groups = self.get_changed_groups([mainmenu_id, groups, num_levels,
+                                                      build_mode, options, minitems])
+            if not changed_groups:
+                return False
+
+            # Groups are only independent of each other when building a single profile,
+            # without the combined menu or cloned properties
+            if len(profilelist) != 1 or build_mode == "single":
+                return False
+
+            for option in ("clonewidgets", "clonebackgrounds", "cloneproperties"):
+                if option in options:
+                    return False
+
+            # Checked-for shortcuts and forced settings depend on every item in the menu
+            overridestree = self.data_func.get_overrides_skin().getroot()
+            if overridestree.find("checkforshortcut") is not None or \
+                    overridestree.find("forcesettings") is not None:
+                return False
+
+            # As do any submenu templates
+            temple_object = template.Template()
+            if temple_object.tree is not None and \
+                    (temple_object.tree.find("submenu") is not None or
+                     temple_object.tree.find("submenuOther") is not None):
+                return False
+
+            _, paths = self.get_includes_paths()
+            if len(paths) == 0:
+                return False
+
+            tree = ETree.parse(paths[0])
+            root = tree.getroot()
+            includes = {}
+            for include in root.findall("include"):
+                includes[include.attrib.get("name")] = include
+
+            log("Rebuilding groups %s" % ", ".join(sorted(changed_groups)))
+            profile = profilelist[0]
+
+            # Get the id and defaultID of each main menu item
+            self.data_func.clear_label_id()
+            mainmenu_items = {}
+            for index, node in enumerate(self.data_func.get_shortcuts(
+                    "mainmenu", profile_dir=profile[0]).findall("shortcut")):
+                mainmenu_items[node.find("labelID").text] = (index + 1,
+                                                             node.find("defaultID").text)
+
+            for progress_count, submenu in enumerate(sorted(changed_groups)):
+                progress.update(int(100 * progress_count / len(changed_groups)))
+                group_dependencies = self.dependencies["groups"][submenu]
+                count = group_dependencies["level"]
+
+                if group_dependencies["mainmenu"] not in mainmenu_items:
+                    return False
+
+                itemidmainmenu, submenu_default_id = \
+                    mainmenu_items[group_dependencies["mainmenu"]]
+
+                default_group = None
+                if count == 0:
+                    default_group = submenu_default_id
+
+                submenuitems = self.data_func.get_shortcuts(
+                    submenu, default_group, profile[0], is_sub_level=count != 0
+                ).findall("shortcut")
+
+                # If the group has gained or lost all its items, the main menu changes too
+                if (len(submenuitems) == 0) != group_dependencies["empty"]:
+                    return False
+
+                visibility_name = self.data_func.slugify(group_dependencies["mainmenu"],
+                                                         convert_int=True)
+
+                # Build the submenu items
+                menuitems = []
+                skin_bools = []
+                for itemidsubmenu, submenu_item in enumerate(submenuitems):
+                    menuitem, all_props = self.build_element(submenu_item, submenu, None,
+                                                             profile[1], itemid=itemidsubmenu + 1,
+                                                             mainmenuid=itemidmainmenu,
+                                                             options=options)
+                    is_submenu_element = ETree.SubElement(menuitem, "property")
+                    is_submenu_element.set("name", "isSubmenu")
+                    is_submenu_element.text = "True"
+
+                    skin_bools += self.get_skin_bools(all_props)
+
+                    # Remove any template-only properties
+                    other_properties, _, template_only = self.data_func.get_property_requires()
+                    for key in other_properties:
+                        # pylint: disable=unsupported-membership-test,useless-suppression
+                        if key in all_props and key in template_only:
+                            menuitem.remove(all_props[key])
+                            all_props.pop(key)
+
+                    menuitems.append(menuitem)
+
+                # The widget and background skin bools are only reset by a full build
+                if sorted(set(skin_bools)) != group_dependencies["skinbools"]:
+                    return False
+
+                if "noGroups" not in options:
+                    group_include = self.get_group_include(submenu, count)
+                    justmenu_tree_a = includes.get("skinshortcuts-group-%s" % group_include)
+                    justmenu_tree_b = includes.get("skinshortcuts-group-alt-%s" % group_include)
+                    if justmenu_tree_a is None or justmenu_tree_b is None:
+                        return False
+
+                    for justmenu_tree in (justmenu_tree_a, justmenu_tree_b):
+                        for child in list(justmenu_tree):
+                            justmenu_tree.remove(child)
+
+                    for menuitem in menuitems:
+                        justmenu_tree_a.append(temple_object.copy_tree(menuitem))
+
+                        menu_item_copy = temple_object.copy_tree(menuitem)
+                        visibility_element = menu_item_copy.find("visible")
+                        visibility_element.text = \
+                            "[%s] + %s" % (
+                                visibility_element.text,
+                                "String.IsEqual(Window(10000).Property(submenuVisibility),%s)" %
+                                visibility_name
+                            )
+                        justmenu_tree_b.append(menu_item_copy)
+
+                    if len(menuitems) == 0:
+                        newelement = ETree.Element("description")
+                        newelement.text = "No items"
+                        justmenu_tree_a.append(newelement)
+                        justmenu_tree_b.append(newelement)
+
+                # Replace the group's items in the submenu include
+                if count == 0:
+                    submenu_tree = includes.get("skinshortcuts-submenu")
+                else:
+                    submenu_tree = includes.get("skinshortcuts-submenu-%s" % str(count))
+
+                if submenu_tree is None:
+                    return False
+
+                # Find the group's items from the number of items each group added to it
+                submenu_groups = self.dependencies["submenus"][count]
+                group_names = [submenu_group[0] for submenu_group in submenu_groups]
+                if group_names.count(submenu) != 1 or \
+                        len(submenu_tree) != sum(submenu_group[1]
+                                                 for submenu_group in submenu_groups):
+                    # We can't tell where the group's items are
+                    return False
+
+                group_index = group_names.index(submenu)
+                position = sum(submenu_group[1] for submenu_group in submenu_groups[:group_index])
+                end_position = position + submenu_groups[group_index][1]
+                for child in list(submenu_tree)[position:end_position]:
+                    submenu_tree.remove(child)
+
+                submenu_groups[group_index][1] = len(menuitems)
+
+                for offset, menuitem in enumerate(menuitems):
+                    menu_item_copy = temple_object.copy_tree(menuitem)
+                    visibility_element = menu_item_copy.find("visible")
+                    visibility_element.text = \
+                        "[%s] + %s" % (
+                            visibility_element.text,
+                            "String.IsEqual(Container(%s)"
+                            ".ListItem.Property(submenuVisibility),%s)" %
+                            (mainmenu_id, visibility_name)
+                        )
+                    submenu_tree.insert(position + offset, menu_item_copy)
+
+        except:
+            log(print_exc())
+            log("Unable to update the menu, rebuilding the full menu")
+            return False
+
+        progress.update(100, message=LANGUAGE(32098))
+
+        # Keep everything but the file hashes from the previous build
+        hashlist = []
+        for hashed in self.hashes:
+            if hashed and hashed[0].startswith("::") and hashed[0] != "::DEPENDENCIES::":
+                hashlist.append(hashed)
+
+        self.dependencies["properties"] = hash_properties()
+        hashlist.append(["::DEPENDENCIES::", self.dependencies])
+
+        # writing includes, all resolutions share the same hash
+        hexdigest = self.write_includes(root, paths)
+        for path in paths:
+            hashlist.append([path, hexdigest, generate_file_stat(path)])
+
+        # We already have hashes for the files checked by shouldwerun
+        hashable = set(self.file_hashes.keys())
+        hashable.update(self.data_func.hashable)
+        hashable = sorted(item for item in hashable if item not in paths)
+        rehash = [item for item in hashable
+                  if item in self.changed_files or item not in self.file_hashes]
+        for item in rehash:
+            self.file_stats[item] = generate_file_stat(item)
+        self.file_hashes.update(zip(rehash, generate_file_hashes(rehash)))
+
+        for item in hashable:
+            hexdigest = self.file_hashes[item]
+            if hexdigest:
+                hashlist.append([item, hexdigest, self.file_stats.get(item)])
+            else:
+                hashlist.append([item, None])
+
+        # Save the hashes
+        write_hashes(hashlist)
+
+        return True
+
+    def get_changed_groups(self, arguments):
+        # Work out which submenu groups use the files which have changed since the last build.
+        # Returns None if the changes can't be narrowed down to submenu groups
+        if self.dependencies is None or self.dependencies.get("arguments") != arguments or \
+                "submenus" not in self.dependencies:
+            return None
+
+        changed_files = set(self.changed_files)
+        for path in self.dependencies["files"]:
+            if path not in self.file_hashes and xbmcvfs.exists(path):
+                # A file which didn't exist when we last built the menu
+                changed_files.add(path)
+
+        changed_groups = set()
+        for path in changed_files:
+            if path == PROPERTIES_FILE:
+                continue
+
+            if path not in self.dependencies["files"]:
+                log("%s isn't only used by submenus" % path)
+                return None
+
+            changed_groups.update(self.dependencies["files"][path])
+
+        if PROPERTIES_FILE in changed_files:
+            # Find the groups whose saved properties have changed
+            previous_hashes = self.dependencies["properties"]
+            current_hashes = hash_properties()
+            for group in set(previous_hashes.keys()) | set(current_hashes.keys()):
+                if previous_hashes.get(group) == current_hashes.get(group):
+                    continue
+
+                if group not in self.dependencies["groups"]:
+                    log("Properties for %s have changed" % group)
+                    return None
+
+                changed_groups.add(group)
+
+        return changed_groups
+
+    def write_includes(self, root, paths):
+        # Serialize the includes once, then write the same bytes for every resolution
+        # (files which already contain exactly these bytes are left alone)
+        payload = serialize_xml(root)
+        hexdigest = generate_hash(payload)
+        for path in paths:
+            if generate_file_hash(path) == hexdigest:
+                continue
+
+            write_file(path, payload, mode='wb')
+            self.includes_changed = True
+
+        return hexdigest
+
+    def get_includes_paths(self):
+        # Get the skin version, and the includes file for each resolution the skin supports
+        addon_xml = xbmcvfs.translatePath(os.path.join("special://skin/", 'addon.xml'))
+        addon = ETree.parse(addon_xml)
+        extensionpoints = addon.findall("extension")
+
+        paths = []
         for extensionpoint in extensionpoints:
             if extensionpoint.attrib.get("point") == "xbmc.gui.skin":
                 resolutions = extensionpoint.findall("res")
@@ -758,19 +1162,27 @@ class XMLFunctions:
                         os.path.join(self.skin_dir, resolution.attrib.get("folder"),
                                      "script-skinshortcuts-includes.xml")
                     )
-                    tree.write(path, encoding="UTF-8")  # writing includes
-                    hashable.add(path)
+                    paths.append(path)
 
-        hashable.update(self.data_func.hashable)
-        hashable.update(temple_object.hashable)
+        return addon.getroot().attrib.get("version"), paths
 
-        for item in hashable:  # generate a hash for all paths
-            hexdigest = generate_file_hash(item)
-            if hexdigest:
-                hashlist.append([item, hexdigest])
+    def get_group_include(self, submenu, level):
+        # Get the name used by the skinshortcuts-group-* includes of a submenu
+        if level != 0:
+            return "%s-%s" % (self.data_func.slugify(submenu[:-2], convert_int=True),
+                              submenu[-1:])
 
-        # Save the hashes
-        write_hashes(hashlist)
+        return self.data_func.slugify(submenu, convert_int=True)
+
+    @staticmethod
+    def get_skin_bools(all_props):
+        # Get the widget and background skin bools set by building an item
+        skin_bools = []
+        for key in ("widget", "background"):
+            if key in all_props:
+                skin_bools.append("%s-%s" % (key, all_props[key].text))
+
+        return skin_bools
 
     def build_element(self, item, group_name, visibility_condition, profile_visibility,
                       submenu_visibility=None, itemid=-1, mainmenuid=None, options=None):
@@ -844,7 +1256,7 @@ class XMLFunctions:
             self.main_properties = {}
 
         # Additional properties
-        properties = ast.literal_eval(item.find("additional-properties").text)
+        properties = get_additional_properties(item.find("additional-properties"))
         for prop in properties:
             if prop[0] == "node.visible":
                 visible_property = ETree.SubElement(newelement, "visible")
@@ -1068,11 +1480,9 @@ class XMLFunctions:
         if len(property_patterns) > 0:
             property_replacements = self.get_property_replacements(newelement)
             for property_name in list(property_patterns.keys()):
-                property_pattern = property_patterns[property_name][0]
-                for original, replacement in property_replacements:
-                    regexp_pattern = re.compile(re.escape(original), re.IGNORECASE)
-                    property_pattern = regexp_pattern.sub(replacement.replace("\\", r"\\"),
-                                                          property_pattern)
+                property_pattern = self.replace_property_pattern(
+                    property_patterns[property_name][0], property_replacements
+                )
 
                 additionalproperty = ETree.SubElement(newelement, "property")
                 additionalproperty.set("name", property_name)
@@ -1082,46 +1492,82 @@ class XMLFunctions:
         return newelement, all_props
 
     def get_property_patterns(self, label_id, group):
-        property_patterns = {}
         if not self.loaded_property_patterns:
-            overrides = self.data_func.get_overrides_skin()
-            self.property_patterns = overrides.getroot().findall("propertypattern")
+            self.property_patterns = self.index_property_patterns()
             self.loaded_property_patterns = True
 
-        for property_pattern_element in self.property_patterns:
+        # Patterns for this labelID take priority over patterns for the whole group,
+        # with properties kept in the order they first appear in the overrides
+        candidates = {}
+        for property_name, (position, text) in \
+                self.property_patterns.get((group, None), {}).items():
+            candidates[property_name] = (position, text, False)
+
+        if label_id:
+            for property_name, (position, text) in \
+                    self.property_patterns.get((group, label_id), {}).items():
+                if property_name in candidates:
+                    position = min(position, candidates[property_name][0])
+                candidates[property_name] = (position, text, True)
+
+        property_patterns = {}
+        for property_name, (_, text, is_label_id) in \
+                sorted(candidates.items(), key=lambda candidate: candidate[1][0]):
+            property_patterns[property_name] = [text, is_label_id]
+
+        return property_patterns
+
+    def index_property_patterns(self):
+        # Index the skins property patterns by (group, labelID), or (group, None) for patterns
+        # which apply to the whole group. Only the first pattern for each property is kept
+        property_patterns = {}
+        overrides = self.data_func.get_overrides_skin()
+        for position, property_pattern_element in \
+                enumerate(overrides.getroot().findall("propertypattern")):
             property_name = property_pattern_element.get("property")
             property_group = property_pattern_element.get("group")
 
-            if not property_name or not property_group or property_group != group or \
-                    not property_pattern_element.text:
+            if not property_name or not property_group or not property_pattern_element.text:
                 continue
 
-            property_label_id = property_pattern_element.get("labelID")
-            if not property_label_id:
-                if property_name not in property_patterns:
-                    property_patterns[property_name] = [property_pattern_element.text, False]
-
-            elif property_label_id == label_id:
-                if property_name not in property_patterns or \
-                        property_patterns[property_name][1] is False:
-                    property_patterns[property_name] = [property_pattern_element.text, True]
+            key = (property_group, property_pattern_element.get("labelID") or None)
+            property_patterns.setdefault(key, {}).setdefault(
+                property_name, (position, property_pattern_element.text)
+            )
 
         return property_patterns
 
     @staticmethod
     def get_property_replacements(element):
-        property_replacements = []
+        # Values to replace ::name:: with, keyed by lowercase name (the first value wins)
+        property_replacements = {}
         for sub_element in list(element):
             if sub_element.tag == "property":
                 property_name = sub_element.get("name")
                 if property_name and sub_element.text:
-                    property_replacements.append(("::%s::" % property_name, sub_element.text))
+                    property_replacements.setdefault(property_name.lower(), sub_element.text)
 
             elif sub_element.text:
-                property_replacements.append(("::%s::" % sub_element.tag, sub_element.text))
+                property_replacements.setdefault(sub_element.tag.lower(), sub_element.text)
 
         return property_replacements
 
+    @staticmethod
+    def replace_property_pattern(property_pattern, property_replacements):
+        # Replace every ::name:: we have a value for in a single pass, with one alternation of
+        # the names (so ::unknown:: doesn't use up the colons of a ::name:: next to it)
+        if not property_replacements:
+            return property_pattern
+
+        regexp_pattern = re.compile(
+            "::(%s)::" % "|".join(re.escape(name) for name in property_replacements),
+            re.IGNORECASE
+        )
+        return regexp_pattern.sub(
+            lambda match: property_replacements.get(match.group(1).lower(), match.group(0)),
+            property_pattern
+        )
+
     @staticmethod
     def property_exists(property_name, element):
         for item in element.findall("property"):
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+    Copyright (C) 2013-2021 Skin Shortcuts (script.skinshortcuts)
+    This file is part of script.skinshortcuts
+    SPDX-License-Identifier: GPL-2.0-only
+    See LICENSES/GPL-2.0-only.txt for more information.
+"""
+
+# Just enough of Kodi's python modules to build menus outside of Kodi. special:// paths are
+# translated to directories under a temporary folder, and skin settings are kept in memory
+# pylint: disable=invalid-name
+
+import os
+import sys
+import tempfile
+import types
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMP = tempfile.mkdtemp(prefix="skinshortcuts-")
+
+SKIN_DIR = "skin.test"
+SPECIAL_PATHS = {
+    "special://skin/": os.path.join(TEMP, "skin"),
+    "special://profile/": os.path.join(TEMP, "userdata"),
+    "special://masterprofile/": os.path.join(TEMP, "userdata"),
+    "special://userdata/": os.path.join(TEMP, "userdata"),
+    "special://xbmc/": os.path.join(TEMP, "xbmc"),
+    "special://home/": os.path.join(TEMP, "home"),
+}
+
+WINDOW_PROPERTIES = {}
+SKIN_SETTINGS = {}
+
+
+def translate_path(path):
+    for special, real in SPECIAL_PATHS.items():
+        if path.startswith(special):
+            return os.path.join(real, path[len(special):])
+        if path == special.rstrip("/"):
+            return real
+
+    return path
+
+
+def execute_builtin(builtin):
+    if builtin.startswith("Skin.SetBool("):
+        SKIN_SETTINGS[builtin[13:-1]] = True
+    elif builtin.startswith("Skin.SetString("):
+        name, _, value = builtin[15:-1].partition(",")
+        SKIN_SETTINGS[name] = value
+    elif builtin.startswith("Skin.Reset("):
+        SKIN_SETTINGS.pop(builtin[11:-1], None)
+
+
+def listdir(path):
+    dirs = []
+    files = []
+    for name in sorted(os.listdir(path)):
+        if os.path.isdir(os.path.join(path, name)):
+            dirs.append(name)
+        else:
+            files.append(name)
+
+    return dirs, files
+
+
+class Addon:
+    def __init__(self, id=None):  # pylint: disable=redefined-builtin
+        self.id = id
+
+    @staticmethod
+    def getAddonInfo(key):
+        return {"name": "Skin Shortcuts", "version": "2.0.3", "path": ROOT}.get(key, "")
+
+    @staticmethod
+    def getSetting(_):
+        return ""
+
+    @staticmethod
+    def getSettingBool(_):
+        return False
+
+    @staticmethod
+    def getSettingInt(_):
+        return 0
+
+    @staticmethod
+    def getLocalizedString(_):
+        return ""
+
+    def setSettingBool(self, *_):
+        pass
+
+
+class Window:
+    def __init__(self, window_id=None):
+        self.window_id = window_id
+
+    @staticmethod
+    def getProperty(key):
+        return WINDOW_PROPERTIES.get(key, "")
+
+    @staticmethod
+    def setProperty(key, value):
+        WINDOW_PROPERTIES[key] = value
+
+    @staticmethod
+    def clearProperty(key):
+        WINDOW_PROPERTIES.pop(key, None)
+
+
+class Stat:
+    def __init__(self, path):
+        self.stat = os.stat(translate_path(path))
+
+    def st_mtime(self):
+        return int(self.stat.st_mtime)
+
+    def st_size(self):
+        return self.stat.st_size
+
+
+def install():
+    # Add the fake modules, and the addon's library, to the path
+    for path in SPECIAL_PATHS.values():
+        os.makedirs(path, exist_ok=True)
+
+    xbmc = types.ModuleType("xbmc")
+    xbmc.LOGDEBUG = 0
+    xbmc.log = lambda msg, level=0: None
+    xbmc.executebuiltin = execute_builtin
+    xbmc.getCondVisibility = lambda condition: False
+    xbmc.getInfoLabel = lambda label: "19.0" if label == "System.BuildVersion" else ""
+    xbmc.getLanguage = lambda *args: "English"
+    xbmc.getLocalizedString = lambda string_id: ""
+    xbmc.getSkinDir = lambda: SKIN_DIR
+    xbmc.skinHasImage = lambda image: False
+    xbmc.__getattr__ = lambda name: mock.MagicMock()
+
+    xbmcaddon = types.ModuleType("xbmcaddon")
+    xbmcaddon.Addon = Addon
+
+    xbmcgui = types.ModuleType("xbmcgui")
+    xbmcgui.Window = Window
+    xbmcgui.__getattr__ = lambda name: mock.MagicMock()
+
+    xbmcvfs = types.ModuleType("xbmcvfs")
+    xbmcvfs.translatePath = translate_path
+    xbmcvfs.exists = lambda path: os.path.exists(translate_path(path))
+    xbmcvfs.listdir = lambda path: listdir(translate_path(path))
+    xbmcvfs.Stat = Stat
+    xbmcvfs.__getattr__ = lambda name: mock.MagicMock()
+
+    xbmcplugin = types.ModuleType("xbmcplugin")
+    xbmcplugin.__getattr__ = lambda name: mock.MagicMock()
+
+    for name, module in (("xbmc", xbmc), ("xbmcaddon", xbmcaddon), ("xbmcgui", xbmcgui),
+                         ("xbmcvfs", xbmcvfs), ("xbmcplugin", xbmcplugin)):
+        sys.modules[name] = module
+
+    library = os.path.join(ROOT, "resources", "lib")
+    if library not in sys.path:
+        sys.path.insert(0, library)
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+    Copyright (C) 2013-2021 Skin Shortcuts (script.skinshortcuts)
+    This file is part of script.skinshortcuts
+    SPDX-License-Identifier: GPL-2.0-only
+    See LICENSES/GPL-2.0-only.txt for more information.
+"""
+
+# Incremental rebuilds must write exactly the same includes as a full rebuild
+
+import os
+import shutil
+import unittest
+from unittest import mock
+
+from . import fake_kodi
+
+fake_kodi.install()
+
+# pylint: disable=import-error,wrong-import-position,wrong-import-order
+from skinshorcuts import hash_utils  # noqa: E402
+from skinshorcuts import xmlfunctions  # noqa: E402
+from skinshorcuts.constants import HASH_FILE  # noqa: E402
+
+SKIN_PATH = fake_kodi.SPECIAL_PATHS["special://skin/"]
+SHORTCUTS_PATH = os.path.join(SKIN_PATH, "shortcuts")
+INCLUDES_FILE = os.path.join(SKIN_PATH, "xml", "script-skinshortcuts-includes.xml")
+
+SKIN_ADDON = """<?xml version="1.0" encoding="UTF-8"?>
+<addon id="%s" version="1.0.0" name="Test">
+    <extension point="xbmc.gui.skin" debugging="false">
+        <res width="1920" height="1080" aspect="16:9" default="true" folder="xml" />
+    </extension>
+</addon>
+""" % fake_kodi.SKIN_DIR
+
+MAIN_MENU = ["Movies", "Music", "Pictures"]
+
+SUBMENUS = {
+    "movies": [("Recently added", False), ("Genres", True), ("Titles", False)],
+    "music": [("Artists", False), ("Albums", False)],
+    "pictures": [("Folders", True), ("Slideshow", False)],
+}
+
+
+def shortcuts_xml(items, window="Videos"):
+    shortcuts = []
+    for label, disabled in items:
+        shortcuts.append("<shortcut><label>%s</label><label2>Test</label2>"
+                         "<icon>DefaultShortcut.png</icon><thumb />"
+                         "<action>ActivateWindow(%s,%s)</action>%s</shortcut>" %
+                         (label, window, label, "<disabled>True</disabled>" if disabled else ""))
+
+    return "<?xml version=\"1.0\" encoding=\"UTF-8\"?><shortcuts>%s</shortcuts>" % \
+           "".join(shortcuts)
+
+
+class IncrementalBuildTest(unittest.TestCase):
+    mtime = 1600000000
+
+    def setUp(self):
+        for path in (SKIN_PATH, fake_kodi.SPECIAL_PATHS["special://userdata/"]):
+            shutil.rmtree(path, ignore_errors=True)
+
+        os.makedirs(os.path.join(SKIN_PATH, "xml"))
+        os.makedirs(SHORTCUTS_PATH)
+        os.makedirs(os.path.dirname(HASH_FILE))
+        with open(os.path.join(SKIN_PATH, "addon.xml"), "w", encoding="utf-8") as addon:
+            addon.write(SKIN_ADDON)
+
+        self.write_group("mainmenu", [(label, False) for label in MAIN_MENU])
+        for group, items in SUBMENUS.items():
+            self.write_group(group, items)
+
+        fake_kodi.WINDOW_PROPERTIES.clear()
+
+    def write_group(self, group, items, path=None, window="Videos"):
+        if path is None:
+            path = os.path.join(SHORTCUTS_PATH, "%s.DATA.xml" % group)
+
+        with open(path, "w", encoding="utf-8") as data_xml:
+            data_xml.write(shortcuts_xml(items, window))
+
+        # Make sure every edit is seen, however quickly the files are written
+        IncrementalBuildTest.mtime += 10
+        os.utime(path, (self.mtime, self.mtime))
+
+    def build(self, incremental=None):
+        xml_func = xmlfunctions.XMLFunctions()
+        writexml = mock.patch.object(xml_func, "writexml", wraps=xml_func.writexml)
+        with writexml as full_build:
+            xml_func.build_menu("9000", "", "1", "", [""], 0)
+
+        if incremental is not None:
+            self.assertEqual(full_build.called, not incremental)
+
+        with open(INCLUDES_FILE, "rb") as includes:
+            return includes.read()
+
+    @staticmethod
+    def get_hash(path):
+        for hashed in hash_utils.read_hashes():
+            if hashed[0] == path:
+                return hashed
+
+        return None
+
+    def full_build(self):
+        os.remove(HASH_FILE)
+        return self.build(incremental=False)
+
+    def test_edit_group_with_disabled_items(self):
+        self.build(incremental=False)
+
+        self.write_group("movies", [("Recently added", False), ("Genres", True),
+                                    ("Years", False), ("Titles", False)])
+        incremental = self.build(incremental=True)
+
+        self.assertIn(b"Years", incremental)
+        self.assertEqual(incremental, self.full_build())
+
+    def test_repeated_edits(self):
+        self.build(incremental=False)
+
+        self.write_group("pictures", [("Folders", True), ("Slideshow", True), ("Files", False)])
+        self.build(incremental=True)
+        self.write_group("movies", [("Genres", True), ("Titles", False)])
+        self.build(incremental=True)
+        self.write_group("pictures", [("Folders", True), ("Files", False)])
+        incremental = self.build(incremental=True)
+
+        full = self.full_build()
+        self.assertEqual(incremental.count(b"Folders"), full.count(b"Folders"))
+        self.assertEqual(incremental, full)
+
+    def test_new_user_main_menu(self):
+        self.build(incremental=False)
+
+        # Editing the main menu in the GUI creates the user's own copy of it for the first time
+        user_mainmenu = xmlfunctions.XMLFunctions().data_func.get_shortcuts_paths("mainmenu")[0]
+        os.makedirs(os.path.dirname(user_mainmenu), exist_ok=True)
+        self.write_group("mainmenu", [(label, False) for label in MAIN_MENU],
+                         path=user_mainmenu, window="Music")
+        self.write_group("music", [("Artists", False)])
+        rebuilt = self.build(incremental=False)
+
+        self.assertIn(b"ActivateWindow(Music,Movies)", rebuilt)
+        self.assertEqual(rebuilt, self.full_build())
+
+    def test_unchanged(self):
+        first = self.build(incremental=False)
+        self.assertEqual(self.build(), first)
+
+    def test_includes_stat_saved(self):
+        self.build(incremental=False)
+
+        # The includes file was too new to trust its stat when it was written
+        self.assertIsNone(self.get_hash(INCLUDES_FILE)[2])
+        os.utime(INCLUDES_FILE, (self.mtime, self.mtime))
+        self.build()
+
+        # Once it's been verified, its stat is saved so it doesn't need hashing again
+        with mock.patch.object(xmlfunctions, "generate_file_hashes",
+                               wraps=xmlfunctions.generate_file_hashes) as generate_file_hashes:
+            self.build()
+
+        self.assertIsNotNone(self.get_hash(INCLUDES_FILE)[2])
+        self.assertNotIn(INCLUDES_FILE, generate_file_hashes.call_args[0][0])
+
+
+if __name__ == "__main__":
+    unittest.main()
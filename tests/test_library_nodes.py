@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+    Copyright (C) 2013-2021 Skin Shortcuts (script.skinshortcuts)
+    This file is part of script.skinshortcuts
+    SPDX-License-Identifier: GPL-2.0-only
+    See LICENSES/GPL-2.0-only.txt for more information.
+"""
+
+# The library node index must notice nodes being added, removed and edited in place
+
+import os
+import shutil
+import unittest
+
+from . import fake_kodi
+
+fake_kodi.install()
+
+# pylint: disable=import-error,wrong-import-position,wrong-import-order
+from skinshorcuts import nodefunctions  # noqa: E402
+from skinshorcuts.constants import PROFILE_PATH  # noqa: E402
+
+VIDEO_PATH = os.path.join(PROFILE_PATH, "library", "video")
+
+
+class LibraryNodesTest(unittest.TestCase):
+    mtime = 1600000000
+
+    def setUp(self):
+        shutil.rmtree(os.path.join(PROFILE_PATH, "library"), ignore_errors=True)
+        os.makedirs(os.path.join(VIDEO_PATH, "movies"))
+
+    def write_node(self, filename, label):
+        path = os.path.join(VIDEO_PATH, filename)
+        with open(path, "w", encoding="utf-8") as node:
+            node.write("<node order=\"1\"><label>%s</label></node>" % label)
+
+        # Edits may be quicker than the resolution of the modification time
+        LibraryNodesTest.mtime += 10
+        os.utime(path, (self.mtime, self.mtime))
+        return path
+
+    @staticmethod
+    def get_nodes():
+        return nodefunctions.NodeFunctions().get_nodes(VIDEO_PATH, "library://video")
+
+    def test_edited_in_place(self):
+        self.write_node(os.path.join("movies", "index.xml"), "Movies")
+        self.assertEqual(self.get_nodes()[1][0], "Movies")
+
+        self.write_node(os.path.join("movies", "index.xml"), "Films")
+        self.assertEqual(self.get_nodes()[1][0], "Films")
+
+    def test_added_and_removed(self):
+        self.write_node(os.path.join("movies", "index.xml"), "Movies")
+        path = self.write_node("recent.xml", "Recent")
+        self.assertEqual(sorted(node[0] for node in self.get_nodes().values()),
+                         ["Movies", "Recent"])
+
+        os.remove(path)
+        self.assertEqual([node[0] for node in self.get_nodes().values()], ["Movies"])
+
+
+if __name__ == "__main__":
+    unittest.main()
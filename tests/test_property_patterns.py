@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+    Copyright (C) 2013-2021 Skin Shortcuts (script.skinshortcuts)
+    This file is part of script.skinshortcuts
+    SPDX-License-Identifier: GPL-2.0-only
+    See LICENSES/GPL-2.0-only.txt for more information.
+"""
+
+# ::name:: placeholders in property patterns are replaced with the item's values
+
+import unittest
+
+from . import fake_kodi
+
+fake_kodi.install()
+
+# pylint: disable=import-error,wrong-import-position,wrong-import-order
+from skinshorcuts.xmlfunctions import XMLFunctions  # noqa: E402
+
+
+class PropertyPatternTest(unittest.TestCase):
+    def test_replacements(self):
+        self.assertEqual(
+            XMLFunctions.replace_property_pattern("::Label::/::labelid::?x=::label::",
+                                                  {"label": "Movies", "labelid": "movies"}),
+            "Movies/movies?x=Movies"
+        )
+
+    def test_unknown_names(self):
+        # Colons shared with an unknown name still belong to the known name next to it
+        self.assertEqual(
+            XMLFunctions.replace_property_pattern("::unknown::label::", {"label": "Movies"}),
+            "::unknownMovies"
+        )
+        self.assertEqual(XMLFunctions.replace_property_pattern("::label::", {}), "::label::")
+
+    def test_values_inserted_literally(self):
+        self.assertEqual(
+            XMLFunctions.replace_property_pattern("::path::", {"path": r"C:\new\::label::"}),
+            r"C:\new\::label::"
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()